@@ -1,33 +1,169 @@
+import asyncio
+import gzip
+import json
 import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import unicodedata
 from asyncio import sleep
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 import aiohttp
 import discord
 from markdownify import markdownify as md
+
+try:
+    # Much faster than json for big payloads, and Red usually has it installed
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 from redbot.core import Config, checks, commands
+from redbot.core.data_manager import cog_data_path
 
 DEFAULT_SETTINGS = {"token": None, "language": "en", "hide_private": True}
 REQUEST_PATH = "https://kanka.io/api/1.0/"
 STORAGE_PATH = "https://kanka-user-assets.s3.eu-central-1.amazonaws.com/"
 MSG_ENTITY_NOT_FOUND = "Entity not found."
-CACHE = {}
+
+# Connection pool settings for the shared Kanka session
+CONNECTION_LIMIT = 10  # Per host, we only ever talk to kanka.io
+DNS_CACHE_TTL = 300  # Seconds
+KEEPALIVE_TIMEOUT = 60  # Seconds an idle connection is kept open
+
+# Kanka allows 30 requests a minute, or 90 for subscribers
+RATE_LIMIT = 30
+RATE_WINDOW = 60  # Seconds
+BACKGROUND_RESERVE = 3  # Requests background work leaves spare for commands
+
+# Failed requests are retried with jittered exponential backoff
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1  # Seconds, doubled for each retry
+RETRY_MAX_DELAY = 30  # Seconds
+
+SYNC_INTERVAL = 10  # Minutes between background cache syncs
+PAGE_SIZE = 100  # Entities asked for per page of a list, Kanka may send fewer
+
+# Popular entities and what they link to are fetched ahead of time when idle
+PREFETCH_INTERVAL = 60  # Seconds between rounds
+PREFETCH_ENTITIES = 5  # Most viewed entities kept warm per campaign
+PREFETCH_REQUESTS = 10  # Most requests a round may make per campaign
+
+# Used to split entries so only as much as will be shown is converted
+HTML_TAG = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9]*)[^>]*?(/?)>")
+HTML_VOID_TAGS = {"area", "br", "col", "embed", "hr", "img", "input", "source", "wbr"}
+HTML_BLOCK_TAGS = {
+    "blockquote",
+    "div",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "ol",
+    "p",
+    "pre",
+    "table",
+    "ul",
+}
+
+MARKDOWN_WORKERS = 2  # Threads converting entries so the event loop isn't held up
+RESOLVE_CONCURRENCY = 5  # Related entities fetched at once for an embed
+
+# Local search
+SEARCH_MIN_SIMILARITY = 0.5  # Share of trigrams in common for a fuzzy match
+SEARCH_CANDIDATES = 5  # Ranked matches checked before falling back to the API
+
+# Entity cache limits, all configurable by the bot owner
+CACHE_MAX_ENTRIES = 100000
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_TTL = 24 * 60 * 60  # Seconds, unless set for the entity type
+
+# Entities fetched in full for display are kept briefly, then revalidated
+FULL_CACHE_ENTRIES = 500
+FULL_CACHE_TTL = 60  # Seconds
+
+# Finished embeds, dropped when their campaign syncs or after the TTL
+EMBED_CACHE_ENTRIES = 500
+EMBED_CACHE_TTL = 10 * 60  # Seconds
+
+# On disk cache format. Bump the version whenever the schema changes and
+# old snapshots will be ignored.
+SNAPSHOT_VERSION = 2
+SNAPSHOT_SCHEMA = ["id", "entity_id", "name", "is_private", "updated_at"]
 
 # TODO: OAuth user tokens?
 
 
-class Campaign:
+def _html_blocks(html):
+    """Split HTML into its top level block elements."""
+    depth = 0
+    start = 0
+    for match in HTML_TAG.finditer(html):
+        closing, tag, self_closing = match.groups()
+        tag = tag.lower()
+        if tag in HTML_VOID_TAGS or self_closing:
+            continue
+        depth = max(depth - 1, 0) if closing else depth + 1
+        if depth == 0 and closing and tag in HTML_BLOCK_TAGS:
+            yield html[start : match.end()]
+            start = match.end()
+    if html[start:].strip():
+        yield html[start:]
+
+
+class LazyEntry:
+    """Keeps the entry HTML and only converts it to markdown when it is
+    displayed. Subclasses set _raw_entry."""
+
+    __slots__ = ()
+    _missing_entry = "<p>This entity doesn't have a description yet.</p>"
+
+    @property
+    def entry(self):
+        if self._entry is None:
+            self._entry = md(self._raw_entry or self._missing_entry, strip=["img"])
+        return self._entry
+
+    def entry_preview(self, limit):
+        """The entry as markdown, stopping once it is longer than limit."""
+        if self._entry is not None:
+            return self._entry
+        if self._preview is not None and len(self._preview) > limit:
+            return self._preview
+
+        parts = []
+        length = 0
+        for block in _html_blocks(self._raw_entry or self._missing_entry):
+            text = md(block, strip=["img"])
+            if text:
+                parts.append(text)
+                length += len(text) + 2
+            if length > limit:
+                self._preview = "\n\n".join(parts)
+                return self._preview
+        # Converted it all anyway
+        self._entry = "\n\n".join(parts)
+        return self._entry
+
+
+class Campaign(LazyEntry):
+    _missing_entry = "<p>This campaign doesn't have a description yet.</p>"
+
     def __init__(self, json_data):
         self.id = json_data.get("id")
         self.name = json_data.get("name")
         self.locale = json_data.get("locale")
-
-        missing_entry_message = "<p>This campaign doesn't have a description yet.</p>"
-        raw_entry = (
-            json_data.get("entry")
-            if json_data.get("entry") is not None
-            else missing_entry_message
-        )
-        self.entry = md(raw_entry, strip=["img"])
+        self._raw_entry = json_data.get("entry")
+        self._entry = None
+        self._preview = None
 
         self.image = (
             f"{STORAGE_PATH}{json_data.get('image')}"
@@ -51,6 +187,18 @@ class Campaign:
         )
 
 
+class GuildSettings:
+    """A guild's settings, read from Config once and kept until a kankaset
+    command changes them."""
+
+    __slots__ = ("language", "hide_private", "active")
+
+    def __init__(self, data):
+        self.language = data["language"]
+        self.hide_private = data["hide_private"]
+        self.active = data["active"]
+
+
 class DiceRoll:
     # Dice are annoyingly inconsistant and so get a class without Entity
     def __init__(self, campaign_id, json_data):
@@ -72,110 +220,738 @@ class DiceRoll:
         self.tags = json_data.get("tags")
 
 
-class Entity:
+def _utc_timestamp():
+    """The current time in the format Kanka uses for lastSync."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _read_snapshot(path, campaign_id):
+    """Load a campaign's cached entities from disk.
+
+    Returns the last sync time and a list of entities, or None if the
+    snapshot is from an incompatible version."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        snapshot = json.load(f)
+    if (
+        snapshot.get("version") != SNAPSHOT_VERSION
+        or snapshot.get("schema") != SNAPSHOT_SCHEMA
+        or snapshot.get("campaign_id") != campaign_id
+    ):
+        return None
+
+    entities = []
+    for entity_type, rows in snapshot["entities"].items():
+        for row in rows:
+            data = dict(zip(SNAPSHOT_SCHEMA, row))
+            entities.append(CachedEntity(campaign_id, entity_type, data))
+    return snapshot.get("last_sync"), entities
+
+
+def _estimate_size(entity):
+    """Rough number of bytes used by an entity and its attributes."""
+    size = sys.getsizeof(entity)
+    for cls in type(entity).__mro__:
+        for attr in getattr(cls, "__slots__", ()):
+            size += sys.getsizeof(getattr(entity, attr, None))
+    return size
+
+
+def _write_snapshot(path, snapshot):
+    """Atomically replace the snapshot at path."""
+    data = gzip.compress(json.dumps(snapshot, separators=(",", ":")).encode())
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` requests every ``per`` seconds.
+
+    Kanka reports the remaining quota and when a blocked client may retry,
+    so the bucket is also corrected from response headers.
+
+    Background requests leave a few tokens spare and give way to waiting
+    command requests, so commands stay quick while the cache is warming."""
+
+    def __init__(self, rate=RATE_LIMIT, per=RATE_WINDOW):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self._lock = asyncio.Lock()
+        self._background_lock = asyncio.Lock()
+        self._waiting = 0  # Command requests waiting for a token
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.tokens = min(self.rate, self.tokens + elapsed * self.rate / self.per)
+        self.updated = now
+
+    async def acquire(self, background=False):
+        if background:
+            async with self._background_lock:
+                await self._take(BACKGROUND_RESERVE)
+            return
+        self._waiting += 1
+        try:
+            async with self._lock:
+                await self._take(0)
+        finally:
+            self._waiting -= 1
+
+    async def _take(self, reserve):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if reserve and self._waiting:
+                await sleep(self.per / self.rate)
+                continue
+            needed = 1 + min(reserve, self.rate - 1)
+            if self.tokens >= needed:
+                self.tokens -= 1
+                return
+            await sleep((needed - self.tokens) * self.per / self.rate)
+
+    def idle(self):
+        """True if no command is waiting and at least half the quota is free."""
+        self._refill(time.monotonic())
+        return not self._waiting and self.tokens >= self.rate / 2
+
+    def block(self, seconds):
+        """Stop handing out tokens for the given number of seconds."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def update(self, headers):
+        """Trust the server's count of remaining requests over our own."""
+        remaining = headers.get("X-RateLimit-Remaining")
+        if remaining is not None and remaining.isdigit():
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, int(remaining))
+
+    @staticmethod
+    def retry_after(headers):
+        """Seconds to wait after a 429, taken from the response headers."""
+        retry = headers.get("Retry-After")
+        if retry is not None and retry.isdigit():
+            return int(retry)
+        reset = headers.get("X-RateLimit-Reset")
+        if reset is not None and reset.isdigit():
+            return max(int(reset) - time.time(), 1)
+        return RATE_WINDOW
+
+
+class KankaError(Exception):
+    """A request to Kanka failed after retrying."""
+
+
+class KankaResponse:
+    """The parts of a Kanka response we use, read before the connection
+    is released. ``json`` is None unless the request succeeded."""
+
+    __slots__ = ("url", "status", "headers", "json")
+
+    def __init__(self, url, status, headers, json):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.json = json
+
+
+def _search_tokens(text):
+    """Split text into lowercase words without accents or punctuation."""
+    text = unicodedata.normalize("NFKD", text or "").casefold()
+    return "".join(
+        c if c.isalnum() else " " for c in text if not unicodedata.combining(c)
+    ).split()
+
+
+def _trigrams(name):
+    padded = f"  {name} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Index of a campaign's cached entity names for answering searches
+    without the API.
+
+    Matches are ranked exact name first, then names or words starting with
+    the query, then fuzzy matches by the share of trigrams in common."""
+
+    def __init__(self):
+        self._names = {}  # (entity_type, id) -> normalised name
+        self._exact = {}  # normalised name -> keys
+        self._words = {}  # word -> keys
+        self._sorted_words = []  # Sorted for prefix searches, rebuilt lazily
+        self._words_changed = False
+        self._trigrams = {}  # trigram -> keys
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, entity_type, entity_id, name):
+        key = (entity_type, entity_id)
+        self.remove(entity_type, entity_id)
+        words = _search_tokens(name)
+        normalised = " ".join(words)
+        self._names[key] = normalised
+        self._exact.setdefault(normalised, set()).add(key)
+        for word in words:
+            if word not in self._words:
+                self._words[word] = set()
+                self._words_changed = True
+            self._words[word].add(key)
+        for trigram in _trigrams(normalised):
+            self._trigrams.setdefault(trigram, set()).add(key)
+
+    def remove(self, entity_type, entity_id):
+        key = (entity_type, entity_id)
+        normalised = self._names.pop(key, None)
+        if normalised is None:
+            return
+        self._discard(self._exact, normalised, key)
+        for word in normalised.split():
+            if self._discard(self._words, word, key):
+                self._words_changed = True
+        for trigram in _trigrams(normalised):
+            self._discard(self._trigrams, trigram, key)
+
+    @staticmethod
+    def _discard(index, value, key):
+        """Remove key from index[value]. Returns True if value is now gone."""
+        keys = index.get(value)
+        if keys is None:
+            return False
+        keys.discard(key)
+        if not keys:
+            del index[value]
+            return True
+        return False
+
+    def _prefixed(self, prefix):
+        """Keys with a word starting with prefix."""
+        if self._words_changed:
+            self._sorted_words = sorted(self._words)
+            self._words_changed = False
+        keys = set()
+        i = bisect_left(self._sorted_words, prefix)
+        while i < len(self._sorted_words) and self._sorted_words[i].startswith(prefix):
+            keys |= self._words[self._sorted_words[i]]
+            i += 1
+        return keys
+
+    def search(self, query, entity_type=None, fuzzy=True):
+        """Keys of the best matches for query, best first. Names sharing
+        enough trigrams with the query are only matched if fuzzy is true."""
+        words = _search_tokens(query)
+        if not words:
+            return []
+        normalised = " ".join(words)
+
+        def ranked(keys):
+            keys = [k for k in keys if entity_type is None or k[0] == entity_type]
+            # Prefer the shortest names, they match the query most closely
+            return sorted(keys, key=lambda k: (len(self._names[k]), k))
+
+        exact = ranked(self._exact.get(normalised, ()))
+        if exact:
+            return exact
+
+        # Every word of the query must start a word of the name
+        prefixed = self._prefixed(words[0])
+        for word in words[1:]:
+            prefixed &= self._prefixed(word)
+        prefixed = ranked(prefixed)
+        if prefixed or not fuzzy:
+            return prefixed
+
+        query_trigrams = _trigrams(normalised)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        scores = []
+        for key, count in shared.items():
+            if entity_type is not None and key[0] != entity_type:
+                continue
+            # Dice coefficient
+            total = len(query_trigrams) + len(self._names[key]) + 1
+            similarity = 2 * count / total
+            if similarity >= SEARCH_MIN_SIMILARITY:
+                scores.append((-similarity, key))
+        return [key for _, key in sorted(scores)]
+
+
+class EntityCache:
+    """Cached entities keyed by campaign, entity type and ID.
+
+    Guilds using the same campaign share its entities. Each guild holds a
+    reference to its active campaign, and a campaign's entities are only
+    dropped once no guild references it any more.
+
+    The cache is bounded by entry count and estimated size, evicting the
+    least recently used entities first, and entities expire after a TTL
+    that can be set per entity type. Each sync of a campaign restarts the
+    TTLs of its entities, as it confirms the unchanged ones are current.
+    If one expires anyway the campaign is marked as never synced, so it
+    is loaded again in full."""
+
+    def __init__(
+        self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttls=None
+    ):
+        # (campaign_id, entity_type, id) -> (entity, expiry, size)
+        # Ordered from least to most recently used
+        self._entities = OrderedDict()
+        self._entity_ids = {}  # (campaign_id, entity_id) -> key in _entities
+        self._counts = {}  # campaign_id -> number of entities cached
+        self._indexes = {}  # campaign_id -> SearchIndex of cached names
+        self._refs = {}  # campaign_id -> number of guilds using it
+        self._guilds = {}  # guild_id -> campaign_id
+        self._synced = {}  # campaign_id -> lastSync timestamp
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = ttls if ttls is not None else {}  # entity_type -> seconds
+        self.size = 0  # Estimated bytes used by cached entities
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def acquire(self, guild_id, campaign_id):
+        """Point a guild at a campaign, releasing its previous one."""
+        if self._guilds.get(guild_id) == campaign_id:
+            return
+        self.release(guild_id)
+        self._guilds[guild_id] = campaign_id
+        self._refs[campaign_id] = self._refs.get(campaign_id, 0) + 1
+        self._counts.setdefault(campaign_id, 0)
+        self._indexes.setdefault(campaign_id, SearchIndex())
+
+    def release(self, guild_id):
+        campaign_id = self._guilds.pop(guild_id, None)
+        if campaign_id is None:
+            return
+        self._refs[campaign_id] -= 1
+        if self._refs[campaign_id] <= 0:
+            del self._refs[campaign_id]
+            self.clear(campaign_id)
+            del self._counts[campaign_id]
+            del self._indexes[campaign_id]
+
+    def campaigns(self):
+        return list(self._refs)
+
+    def get(self, campaign_id, entity_type, entity_id):
+        key = (campaign_id, entity_type, entity_id)
+        item = self._entities.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        entity, expiry, _ = item
+        if expiry < time.monotonic():
+            self._pop(key)
+            # A delta sync wouldn't bring it back
+            self._synced.pop(campaign_id, None)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entities.move_to_end(key)
+        self.hits += 1
+        return entity
+
+    def put(self, entity):
+        # Nobody is using the campaign any more, so don't keep it around
+        if entity.campaign_id not in self._refs:
+            return
+        key = (entity.campaign_id, entity.entity_type, entity.id)
+        self._pop(key)
+        ttl = self.ttls.get(entity.entity_type, CACHE_TTL)
+        size = _estimate_size(entity)
+        self._entities[key] = (entity, time.monotonic() + ttl, size)
+        if entity.entity_id is not None:
+            self._entity_ids[(entity.campaign_id, entity.entity_id)] = key
+        self._indexes[entity.campaign_id].add(
+            entity.entity_type, entity.id, entity.name
+        )
+        self._counts[entity.campaign_id] += 1
+        self.size += size
+
+        while self._entities and (
+            len(self._entities) > self.max_entries or self.size > self.max_bytes
+        ):
+            self._pop(next(iter(self._entities)))
+            self.evictions += 1
+
+    def get_by_entity_id(self, campaign_id, entity_id):
+        key = self._entity_ids.get((campaign_id, entity_id))
+        if key is None:
+            self.misses += 1
+            return None
+        return self.get(*key)
+
+    def search(self, campaign_id, query, entity_type=None, fuzzy=True):
+        """The best cached match for a name, if there is one."""
+        index = self._indexes.get(campaign_id)
+        if index is None:
+            return None
+        for key in index.search(query, entity_type, fuzzy)[:SEARCH_CANDIDATES]:
+            # Expired entities are still indexed until they are looked up
+            entity = self.get(campaign_id, *key)
+            if entity is not None:
+                return entity
+        return None
+
+    def remove(self, campaign_id, entity_type, entity_id):
+        self._pop((campaign_id, entity_type, entity_id))
+
+    def _pop(self, key):
+        item = self._entities.pop(key, None)
+        if item is not None:
+            self._entity_ids.pop((key[0], item[0].entity_id), None)
+            self._indexes[key[0]].remove(key[1], key[2])
+            self._counts[key[0]] -= 1
+            self.size -= item[2]
+
+    def clear(self, campaign_id):
+        for key in [k for k in self._entities if k[0] == campaign_id]:
+            self._pop(key)
+        self._synced.pop(campaign_id, None)
+
+    def count(self, campaign_id):
+        return self._counts.get(campaign_id, 0)
+
+    def stats(self):
+        return {
+            "entities": len(self._entities),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def last_sync(self, campaign_id):
+        """When the campaign was last fully loaded or synced, if ever."""
+        return self._synced.get(campaign_id)
+
+    def set_last_sync(self, campaign_id, timestamp):
+        if campaign_id not in self._refs:
+            return
+        self._synced[campaign_id] = timestamp
+        now = time.monotonic()
+        for key, (entity, _, size) in self._entities.items():
+            if key[0] == campaign_id:
+                ttl = self.ttls.get(key[1], CACHE_TTL)
+                self._entities[key] = (entity, now + ttl, size)
+
+    def snapshot(self, campaign_id):
+        """A compact copy of a campaign's entities for saving to disk, or
+        None if it has never been synced, as it couldn't be brought up to
+        date after restoring."""
+        if campaign_id not in self._refs or self._synced.get(campaign_id) is None:
+            return None
+        entities = {}
+        now = time.monotonic()
+        for (cmpgn_id, entity_type, _), (entity, expiry, _) in self._entities.items():
+            if cmpgn_id == campaign_id and expiry >= now:
+                entities.setdefault(entity_type, []).append(entity.snapshot_row())
+        return {
+            "version": SNAPSHOT_VERSION,
+            "schema": SNAPSHOT_SCHEMA,
+            "campaign_id": campaign_id,
+            "last_sync": self._synced.get(campaign_id),
+            "entities": entities,
+        }
+
+    def restore(self, campaign_id, last_sync, entities):
+        for entity in entities:
+            self.put(entity)
+        self.set_last_sync(campaign_id, last_sync)
+
+
+class EntityBase:
+    """Fields every entity has, whether cached or fetched in full."""
+
+    __slots__ = ("campaign_id", "id", "entity_id", "name", "is_private", "updated_at")
+
     def __init__(self, campaign_id, json_data):
         self.campaign_id = campaign_id
-        self.created_at = json_data.get("created_at")
-        self.created_by = json_data.get("created_by")
+        self.id = json_data.get("id")
         self.entity_id = json_data.get("entity_id")
+        self.name = json_data.get("name")
+        self.is_private = json_data.get("is_private")
+        self.updated_at = json_data.get("updated_at")
 
-        missing_entry_message = "<p>This entity doesn't have a description yet.</p>"
-        raw_entry = (
-            json_data.get("entry_parsed")
-            if json_data.get("entry_parsed") is not None
-            else missing_entry_message
+    def link(self, lang="en", pretty=True):  # TODO: Improve language support?
+        link = (
+            f"https://kanka.io/{lang}/campaign/"
+            f"{self.campaign_id}/{self.entity_type}/{self.id}"
         )
-        self.entry = md(raw_entry, strip=["img"])
+        return f"[{self.name}]({link})" if pretty else link
 
-        self.id = json_data.get("id")
+
+class CachedEntity(EntityBase):
+    """Just enough of an entity to link to it and check if it is private."""
+
+    __slots__ = ("entity_type",)
+
+    def __init__(self, campaign_id, entity_type, json_data):
+        super().__init__(campaign_id, json_data)
+        self.entity_type = entity_type
+
+    def snapshot_row(self):
+        """Values for SNAPSHOT_SCHEMA, in order."""
+        return [self.id, self.entity_id, self.name, self.is_private, self.updated_at]
+
+
+# API type name -> Entity subclass, filled in as they are defined
+ENTITY_REGISTRY = {}
+
+
+class FullEntityCache:
+    """Entities fetched in full for display, with the validators needed to
+    cheaply check they haven't changed.
+
+    Entities are served directly for FULL_CACHE_TTL seconds after they
+    were fetched or revalidated. After that they should be revalidated
+    with a conditional request."""
+
+    def __init__(self, max_entries=FULL_CACHE_ENTRIES, ttl=FULL_CACHE_TTL):
+        # (campaign_id, entity_type, id, related) -> (entity, checked, headers)
+        # Ordered from least to most recently used
+        self._entities = OrderedDict()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.revalidated = 0
+
+    def get(self, key):
+        """The cached entity and whether it is still fresh."""
+        item = self._entities.get(key)
+        if item is None:
+            return None, False
+        self._entities.move_to_end(key)
+        entity, checked, _ = item
+        fresh = time.monotonic() - checked < self.ttl
+        if fresh:
+            self.hits += 1
+        return entity, fresh
+
+    def peek(self, key):
+        """The cached entity and whether it is still fresh, without
+        counting it as used."""
+        item = self._entities.get(key)
+        if item is None:
+            return None, False
+        return item[0], time.monotonic() - item[1] < self.ttl
+
+    def validators(self, key):
+        """Headers making a request conditional on the entity changing."""
+        item = self._entities.get(key)
+        return item[2] if item is not None else {}
+
+    def put(self, key, entity, response_headers):
+        headers = {}
+        if "ETag" in response_headers:
+            headers["If-None-Match"] = response_headers["ETag"]
+        if "Last-Modified" in response_headers:
+            headers["If-Modified-Since"] = response_headers["Last-Modified"]
+        self._entities[key] = (entity, time.monotonic(), headers)
+        self._entities.move_to_end(key)
+        while len(self._entities) > self.max_entries:
+            self._entities.popitem(last=False)
+
+    def touch(self, key):
+        """Mark an entity as fresh after the server said it is unchanged."""
+        entity, _, headers = self._entities[key]
+        self._entities[key] = (entity, time.monotonic(), headers)
+        self.revalidated += 1
+
+    def invalidate(self, campaign_id, entity_type, entity_id, updated_at=None):
+        """Drop an entity, or only the copies older than updated_at."""
+        for related in (False, True):
+            key = (campaign_id, entity_type, entity_id, related)
+            item = self._entities.get(key)
+            if item is not None and (
+                updated_at is None or item[0].updated_at != updated_at
+            ):
+                del self._entities[key]
+
+    def clear(self, campaign_id):
+        for key in [k for k in self._entities if k[0] == campaign_id]:
+            del self._entities[key]
+
+
+class EmbedCache:
+    """Finished embeds, so showing a popular entity again costs nothing.
+
+    Embeds are keyed by campaign, entity type, ID, the entity's
+    updated_at and the guild settings that change how it is shown. Links
+    to other entities can go stale, so a campaign's embeds are cleared
+    whenever its entities are synced."""
+
+    def __init__(self, max_entries=EMBED_CACHE_ENTRIES, ttl=EMBED_CACHE_TTL):
+        # key -> (embed, expiry), least recently used first
+        self._embeds = OrderedDict()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+
+    def get(self, key):
+        item = self._embeds.get(key)
+        if item is None:
+            return None
+        embed, expiry = item
+        if time.monotonic() >= expiry:
+            del self._embeds[key]
+            return None
+        self._embeds.move_to_end(key)
+        self.hits += 1
+        return embed
+
+    def put(self, key, embed):
+        self._embeds[key] = (embed, time.monotonic() + self.ttl)
+        self._embeds.move_to_end(key)
+        while len(self._embeds) > self.max_entries:
+            self._embeds.popitem(last=False)
+
+    def clear(self, campaign_id=None):
+        if campaign_id is None:
+            self._embeds.clear()
+            return
+        for key in [k for k in self._embeds if k[0] == campaign_id]:
+            del self._embeds[key]
+
+
+class Entity(EntityBase, LazyEntry):
+    """An entity fetched in full for display.
+
+    Subclasses declare the API type name, the endpoint holding that type,
+    the KankaView method that displays it and any extra fields to load as
+    a mapping of attribute to JSON key."""
+
+    api_type = None
+    entity_type = None
+    display = None
+    fetch_related = False  # Whether the display command asks for ?related=1
+    fields = {}
+    relations = {}  # Attribute holding a related entity's ID -> its endpoint
+
+    __slots__ = ("type_", "tags", "image", "files", "_raw_entry", "_entry", "_preview")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        ENTITY_REGISTRY[cls.api_type] = cls
+
+    def __init__(self, campaign_id, json_data):
+        super().__init__(campaign_id, json_data)
+        self.type_ = json_data.get("type")
+        self.tags = json_data.get("tags")
+        self._raw_entry = json_data.get("entry_parsed")
+        self._entry = None
+        self._preview = None
         self.image = (
             f"{STORAGE_PATH}{json_data.get('image')}"
             if json_data.get("image") is not None
             else ""
         )
-        self.is_private = json_data.get("is_private")
-        self.name = json_data.get("name")
-        self.tags = json_data.get("tags")
-        self.created_at = json_data.get("created_at")
-        self.updated_at = json_data.get("updated_at")
-        self.type_ = json_data.get("type")
 
-        self.files = {}
         if "entity_files" in json_data:
+            self.files = {}
             for entity in json_data.get("entity_files"):
                 if entity.get("visibility") == "all":
                     self.files[entity.get("name")] = entity.get("path")
         else:
             self.files = None
 
-    def link(self, lang="en", pretty=True):  # TODO: Improve language support?
-        link = (
-            f"https://kanka.io/{lang}/campaign/"
-            f"{self.campaign_id}/{self.entity_type}/{self.id}"
-        )
-        return f"[{self.name}]({link})" if pretty else link
+        for attr, key in self.fields.items():
+            setattr(self, attr, json_data.get(key))
+
+    def references(self):
+        """(entity_type, id) pairs for the entities this one links to."""
+        refs = [("tags", tag_id) for tag_id in self.tags or []]
+        for attr, entity_type in self.relations.items():
+            refs.append((entity_type, getattr(self, attr)))
+        return refs
 
 
 class Character(Entity):
-    def __init__(self, campaign_id, json_data):
-        super().__init__(campaign_id, json_data)
-        self.age = json_data.get("age")
-        self.family_id = json_data.get("family_id")
-        self.is_dead = json_data.get("is_dead")
-        self.location_id = json_data.get("location_id")
-        self.race_id = json_data.get("race_id")
-        self.sex = json_data.get("sex")
-        self.title = json_data.get("title")
-        self.entity_type = "characters"
+    api_type = "character"
+    entity_type = "characters"
+    display = "display_character"
+    fetch_related = True
+    fields = {
+        "age": "age",
+        "family_id": "family_id",
+        "is_dead": "is_dead",
+        "location_id": "location_id",
+        "race_id": "race_id",
+        "sex": "sex",
+        "title": "title",
+    }
+    relations = {
+        "race_id": "races",
+        "location_id": "locations",
+        "family_id": "families",
+    }
+    __slots__ = tuple(fields)
 
 
 class Location(Entity):
+    api_type = "location"
+    entity_type = "locations"
+    display = "display_location"
+    fetch_related = True
+    fields = {"parent_location_id": "parent_location_id", "map": "map"}
+    relations = {"parent_location_id": "locations"}
+    __slots__ = tuple(fields)
+
     def __init__(self, campaign_id, json_data):
         super().__init__(campaign_id, json_data)
-        self.parent_location_id = json_data.get("parent_location_id")
-        self.map = json_data.get("map", [])  # deprecated
-        if "https://kanka.io/images/defaults" in self.map:
+        # deprecated
+        if self.map is not None and "https://kanka.io/images/defaults" in self.map:
             self.map = None
-        self.entity_type = "locations"
 
 
 class Event(Entity):
-    def __init__(self, campaign_id, json_data):
-        super().__init__(campaign_id, json_data)
-        self.date = json_data.get("date")
-        self.location_id = json_data.get("location_id")
-        self.entity_type = "events"
+    api_type = "event"
+    entity_type = "events"
+    display = "display_event"
+    fields = {"date": "date", "location_id": "location_id"}
+    relations = {"location_id": "locations"}
+    __slots__ = tuple(fields)
 
 
 class Family(Entity):
-    def __init__(self, campaign_id, json_data):
-        super().__init__(campaign_id, json_data)
-        self.location_id = json_data.get("location_id")
-        self.parent_family_id = json_data.get("family_id")
-        self.entity_type = "families"
+    api_type = "family"
+    entity_type = "families"
+    display = "display_family"
+    fields = {"location_id": "location_id", "parent_family_id": "family_id"}
+    relations = {"location_id": "locations", "parent_family_id": "families"}
+    __slots__ = tuple(fields)
 
 
 class Calendar(Entity):
-    def __init__(self, campaign_id, json_data):
-        super().__init__(campaign_id, json_data)
-        self.date = json_data.get("date")
-        if json_data.get("has_leap_year"):
-            self.leap_year = {
-                "exist": json_data.get("has_leap_year"),
-                "amount": json_data.get("leap_year_amount"),
-                "month": json_data.get("leap_year_month"),
-                "offset": json_data.get("leap_year_offset"),
-                "start": json_data.get("leap_year_start"),
-            }
-        else:
-            self.leap_year = {"exist": False}
-        self.months = json_data.get("months")
-        self.parameters = json_data.get("parameters")
-        self.seasons = json_data.get("seasons")
-        self.suffix = json_data.get("suffix")
-        self.weekdays = json_data.get("weekdays")
-        self.years = json_data.get("years")
-        self.entity_type = "calendars"
+    api_type = "calendar"
+    entity_type = "calendars"
+    display = "display_calendar"
+    fields = {
+        "date": "date",
+        "months": "months",
+        "suffix": "suffix",
+        "weekdays": "weekdays",
+    }
+    __slots__ = tuple(fields)
 
     def get_month_names(self):
         names = ""
@@ -199,75 +975,107 @@ class Calendar(Entity):
 
 
 class Item(Entity):
-    def __init__(self, campaign_id, json_data):
-        super().__init__(campaign_id, json_data)
-        self.location_id = json_data.get("location_id")
-        self.character_id = json_data.get("character_id")
-        self.entity_type = "items"
+    api_type = "item"
+    entity_type = "items"
+    display = "display_item"
+    fields = {"location_id": "location_id", "character_id": "character_id"}
+    relations = {"character_id": "characters", "location_id": "locations"}
+    __slots__ = tuple(fields)
 
 
 class Journal(Entity):
-    def __init__(self, campaign_id, json_data):
-        super().__init__(campaign_id, json_data)
-        self.date = json_data.get("date")
-        self.character_id = json_data.get("character_id")
-        self.entity_type = "journals"
+    api_type = "journal"
+    entity_type = "journals"
+    display = "display_journal"
+    fields = {"date": "date", "character_id": "character_id"}
+    relations = {"character_id": "characters"}
+    __slots__ = tuple(fields)
 
 
 class Organisation(Entity):
-    def __init__(self, campaign_id, json_data):
-        super().__init__(campaign_id, json_data)
-        self.location_id = json_data.get("location_id")
-        self.members = json_data.get("members")
-        self.entity_type = "organisations"
+    api_type = "organisation"
+    entity_type = "organisations"
+    display = "display_organisation"
+    fields = {"location_id": "location_id", "members": "members"}
+    relations = {"location_id": "locations"}
+    __slots__ = tuple(fields)
+
+    def references(self):
+        members = [("characters", m.get("character_id")) for m in self.members or []]
+        return super().references() + members
 
 
 class Quest(Entity):
-    def __init__(self, campaign_id, json_data):
-        super().__init__(campaign_id, json_data)
-        self.character_id = json_data.get("character_id")
-        self.characters = json_data.get("characters")
-        self.is_completed = json_data.get("is_completed")
-        self.elements = json_data.get("elements")
-        self.parent_quest_id = json_data.get("quest_id")
-        self.entity_type = "quests"
+    api_type = "quest"
+    entity_type = "quests"
+    display = "display_quest"
+    fields = {
+        "character_id": "character_id",
+        "characters": "characters",
+        "is_completed": "is_completed",
+        "elements": "elements",
+        "parent_quest_id": "quest_id",
+    }
+    relations = {"character_id": "characters", "parent_quest_id": "quests"}
+    __slots__ = tuple(fields)
+
+    def references(self):
+        elements = [("entities", el.get("entity_id")) for el in self.elements or []]
+        return super().references() + elements
 
 
 class Tag(Entity):
-    def __init__(self, campaign_id, json_data):
-        super().__init__(campaign_id, json_data)
-        self.tag_id = json_data.get("tag_id")
-        self.entity_type = "tags"
+    api_type = "tag"
+    entity_type = "tags"
+    display = "display_tag"
+    fields = {"tag_id": "tag_id"}
+    relations = {"tag_id": "tags"}
+    __slots__ = tuple(fields)
 
 
 class Note(Entity):
-    def __init__(self, campaign_id, json_data):
-        super().__init__(campaign_id, json_data)
-        # self.is_pinned = json_data.get('is_pinned')
-        self.entity_type = "notes"
+    api_type = "note"
+    entity_type = "notes"
+    display = "display_note"
+    __slots__ = ()
 
 
 class Race(Entity):
-    def __init__(self, campaign_id, json_data):
-        super().__init__(campaign_id, json_data)
-        self.parent_race_id = json_data.get("race_id")
-        self.entity_type = "races"
+    api_type = "race"
+    entity_type = "races"
+    display = "display_race"
+    fields = {"parent_race_id": "race_id"}
+    relations = {"parent_race_id": "races"}
+    __slots__ = tuple(fields)
 
 
 class Ability(Entity):
-    def __init__(self, campaign_id, json_data):
-        super().__init__(campaign_id, json_data)
-        self.parent_ability_id = json_data.get("ability_id")
-        self.charges = json_data.get("charges")
-        self.entity_type = "abilities"
+    api_type = "ability"
+    entity_type = "abilities"
+    display = "display_ability"
+    fields = {"parent_ability_id": "ability_id", "charges": "charges"}
+    relations = {"parent_ability_id": "abilities"}
+    __slots__ = tuple(fields)
 
 
 class Creature(Entity):
-    def __init__(self, campaign_id, json_data):
-        super().__init__(campaign_id, json_data)
-        self.parent_creature_id = json_data.get("creature_id")
-        self.locations = json_data.get("locations")
-        self.entity_type = "Creatures"
+    api_type = "creature"
+    entity_type = "creatures"
+    display = "display_creature"
+    fields = {"parent_creature_id": "creature_id", "locations": "locations"}
+    relations = {"parent_creature_id": "creatures"}
+    __slots__ = tuple(fields)
+
+    def references(self):
+        locations = [("locations", loc_id) for loc_id in self.locations or []]
+        return super().references() + locations
+
+
+# Type names used by the search and entities endpoints, and the
+# endpoints holding entities of that type
+ENTITY_TYPES = {name: cls.entity_type for name, cls in ENTITY_REGISTRY.items()}
+# Endpoint -> Entity subclass
+ENTITY_CLASSES = {cls.entity_type: cls for cls in ENTITY_REGISTRY.values()}
 
 
 class KankaView(commands.Cog):
@@ -276,32 +1084,180 @@ class KankaView(commands.Cog):
         self.config = Config.get_conf(
             self, identifier=56456483622343233254868, force_registration=True
         )
-        self.config.register_global(token=None)
+        self.config.register_global(
+            token=None,
+            rate_limit=RATE_LIMIT,
+            sync_interval=SYNC_INTERVAL,
+            cache_max_entries=CACHE_MAX_ENTRIES,
+            cache_max_bytes=CACHE_MAX_BYTES,
+            cache_ttls={},
+        )
         self.config.register_guild(hide_private=True, language="en", active=None)
         self.session = None
+        self._session_lock = asyncio.Lock()
+        self.headers = None
+        self._token = None
+        self.limiter = RateLimiter()
+        self.cache = EntityCache()
+        self.full_cache = FullEntityCache()
+        self.embed_cache = EmbedCache()
+        self._restoring = {}  # campaign_id -> task loading it from disk
+        self._no_snapshot = set()  # Campaigns without a usable snapshot on disk
+        self._inflight = {}  # key -> task shared by concurrent identical calls
+        self._guild_settings = {}  # guild ID -> GuildSettings
+        self._views = {}  # campaign_id -> Counter of (entity_type, id, related)
+        self._markdown = ThreadPoolExecutor(
+            MARKDOWN_WORKERS, thread_name_prefix="kankaview-markdown"
+        )
+        self._tasks = set()  # Background tasks, kept so they aren't collected
         self.log = logging.getLogger("red.Athena-Cogs.kankaview")
         self.log.setLevel("WARNING")
         if self.bot.get_cog("Dev"):
             self.log.setLevel("DEBUG")
             self.log.debug("KankaView running in debug mode.")
 
+    async def _settings(self, guild):
+        settings = self._guild_settings.get(guild.id)
+        if settings is None:
+            settings = GuildSettings(await self.config.guild(guild).all())
+            self._guild_settings[guild.id] = settings
+        return settings
+
+    def _forget_settings(self, guild):
+        """Drop the guild's settings so they are read again after a change."""
+        self._guild_settings.pop(guild.id, None)
+
     async def _language(self, ctx):
-        language = await self.config.guild(ctx.guild).language()
-        return language
+        return (await self._settings(ctx.guild)).language
+
+    async def cog_load(self):
+        self.cache.max_entries = await self.config.cache_max_entries()
+        self.cache.max_bytes = await self.config.cache_max_bytes()
+        self.cache.ttls = await self.config.cache_ttls()
+        self._spawn(self._sync_loop())
+        self._spawn(self._prefetch_loop())
+
+    async def cog_unload(self):
+        for task in self._tasks:
+            task.cancel()
+        for campaign_id in self.cache.campaigns():
+            await self._save_snapshot(campaign_id)
+        if self.session is not None:
+            await self.session.close()
+        self._markdown.shutdown(wait=False)
 
     async def _active(self, ctx):
-        await self._set_headers()
-        active = await self.config.guild(ctx.guild).active()
+        await self._ensure_session()
+        active = (await self._settings(ctx.guild)).active
         if active is None:
             await ctx.send(
                 "No active campaign set. This will cause errors. "
                 "Please set an active campaign with the `[p]kanka "
                 "campaign <id>` command."
             )
+        else:
+            self.cache.acquire(ctx.guild.id, active)
+            await self._restore_campaign(active)
         return active
 
+    def _snapshot_path(self, campaign_id):
+        return cog_data_path(self) / f"campaign_{campaign_id}.json.gz"
+
+    async def _save_snapshot(self, campaign_id):
+        snapshot = self.cache.snapshot(campaign_id)
+        if snapshot is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                None, _write_snapshot, self._snapshot_path(campaign_id), snapshot
+            )
+        except OSError as e:
+            self.log.warning(f"Unable to save cache for campaign {campaign_id}: {e}")
+            return
+        self._no_snapshot.discard(campaign_id)
+
+    async def _restore_campaign(self, campaign_id):
+        """Load a campaign's cache from disk if it isn't in memory yet.
+
+        Anything changed while the bot was offline is synced afterwards in
+        the background. A missing or unusable snapshot is only tried once,
+        until a new one is saved."""
+        if (
+            self.cache.last_sync(campaign_id) is not None
+            or campaign_id in self._no_snapshot
+        ):
+            return
+        task = self._restoring.get(campaign_id)
+        if task is None:
+            if not self._snapshot_path(campaign_id).exists():
+                self._no_snapshot.add(campaign_id)
+                return
+            task = asyncio.create_task(self._load_snapshot(campaign_id))
+            self._restoring[campaign_id] = task
+            task.add_done_callback(lambda t: self._restoring.pop(campaign_id, None))
+        await task
+
+    async def _load_snapshot(self, campaign_id):
+        loop = asyncio.get_running_loop()
+        try:
+            snapshot = await loop.run_in_executor(
+                None, _read_snapshot, self._snapshot_path(campaign_id), campaign_id
+            )
+        except (OSError, ValueError, KeyError) as e:
+            self.log.warning(f"Unable to load cache for campaign {campaign_id}: {e}")
+            self._no_snapshot.add(campaign_id)
+            return
+        if snapshot is None or snapshot[0] is None:
+            # Outdated, or saved before the campaign was ever synced
+            self.log.info(f"Ignoring outdated cache for campaign {campaign_id}.")
+            self._no_snapshot.add(campaign_id)
+            return
+        last_sync, entities = snapshot
+        self.cache.restore(campaign_id, last_sync, entities)
+        self._spawn(self._sync_entities(campaign_id))
+
+    def _spawn(self, coro):
+        """Run a coroutine in the background, logging any failure."""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+
+        def done(task):
+            self._tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                self.log.warning("Background task failed.", exc_info=task.exception())
+
+        task.add_done_callback(done)
+        return task
+
+    def _shared(self, key, factory):
+        """Await factory() once for all concurrent callers using the same key.
+
+        A caller being cancelled doesn't cancel the call for the others."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None))
+        return asyncio.shield(task)
+
+    async def _ensure_session(self):
+        # The session is long lived so connections to Kanka are reused
+        # between commands. Only build it if we don't have one yet.
+        if self.session is None or self.session.closed:
+            async with self._session_lock:
+                # Another caller may have built it while we waited
+                if self.session is None or self.session.closed:
+                    await self._build_session()
+
     async def _set_headers(self):
+        async with self._session_lock:
+            await self._build_session()
+
+    async def _build_session(self):
         token = await self.config.token()
+        self._token = token
+        self.limiter.rate = await self.config.rate_limit()
         if token:
             headers = {}
             headers["accept"] = "application/json"
@@ -311,21 +1267,75 @@ class KankaView(commands.Cog):
             self.headers = None
         if self.session is not None:
             await self.session.close()
-        self.session = aiohttp.ClientSession(headers=self.headers)
+        connector = aiohttp.TCPConnector(
+            limit_per_host=CONNECTION_LIMIT,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        self.session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+
+    async def _get(self, url, params=None, headers=None, background=False):
+        """Make a GET request to Kanka.
+
+        Every request goes through here to be paced by the rate limiter.
+        Identical requests made at the same time share one response.
+        Rate limited, failed and timed out requests are retried with
+        jittered exponential backoff. Returns a KankaResponse, or None if
+        every attempt failed."""
+        key = (
+            "get",
+            url,
+            tuple(sorted((params or {}).items())),
+            tuple(sorted((headers or {}).items())),
+        )
+        return await self._shared(
+            key, lambda: self._send_get(url, params, headers, background)
+        )
 
-    async def _verify_response(self, r: aiohttp.ClientResponse, check_json=True):
-        if r.status == 200:
-            if check_json and "data" not in await r.json():
-                self.log.debug(f"Data key not in reponse to query {r.url}")
-                self.log.debug(f"Response is {await r.json()}")
+    async def _send_get(self, url, params, headers, background):
+        await self._ensure_session()
+        for attempt in range(MAX_RETRIES + 1):
+            await self.limiter.acquire(background)
+            try:
+                async with self.session.get(url, params=params, headers=headers) as r:
+                    self.limiter.update(r.headers)
+                    if r.status == 429:
+                        retry = self.limiter.retry_after(r.headers)
+                        self.log.info(f"Exceeded Kanka's ratelimit. Sleeping {retry}s.")
+                        self.limiter.block(retry)
+                        error = "rate limited"
+                    elif r.status >= 500:
+                        error = f"status code {r.status}"
+                    else:
+                        # The body is decoded here once and shared with
+                        # everything that needs it
+                        j = None
+                        if r.status == 200:
+                            try:
+                                j = json_loads(await r.read())
+                            except ValueError:
+                                self.log.debug("Invalid JSON in response to %s", r.url)
+                        return KankaResponse(r.url, r.status, r.headers, j)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            if attempt < MAX_RETRIES:
+                delay = RETRY_BASE_DELAY * 2**attempt
+                await sleep(random.uniform(0, min(delay, RETRY_MAX_DELAY)))
+        self.log.warning(f"Unable to complete request to {url}: {error}")
+        return None
+
+    def _verify_response(self, r: KankaResponse, check_json=True):
+        if r is None:
+            return False
+        elif r.status == 200:
+            if check_json and (not isinstance(r.json, dict) or "data" not in r.json):
+                self.log.debug("Data key not in reponse to query %s", r.url)
+                self.log.debug("Response is %s", r.json)
                 return False
             return True
         elif r.status == 404:
             self.log.debug(f"404 for url {r.url}")
             return False
-        elif r.status == 429:
-            self.log.warning("Exceeded Kanka's ratelimit")
-            return False
         else:
             self.log.warning(
                 f"Unable to complete request. Server returned status code {r.status}."
@@ -333,214 +1343,462 @@ class KankaView(commands.Cog):
             return False
 
     async def _get_campaigns_list(self):
-        await self._set_headers()
-        async with self.session.get(REQUEST_PATH + "campaigns") as r:
-            if not await self._verify_response(r):
-                return None
-            j = await r.json()
-            return [Campaign(campaign) for campaign in j["data"]]
+        r = await self._get(REQUEST_PATH + "campaigns")
+        if not self._verify_response(r):
+            return None
+        return [Campaign(campaign) for campaign in r.json["data"]]
 
     async def _get_campaign(self, id):
-        await self._set_headers()
-        async with self.session.get(
+        r = await self._get(
             "{base_url}campaigns/{id}".format(base_url=REQUEST_PATH, id=id)
-        ) as r:
-            if not await self._verify_response(r):
-                return None
-            j = await r.json()
-            return Campaign(j["data"])
+        )
+        if not self._verify_response(r):
+            return None
+        return Campaign(r.json["data"])
 
     async def _get_entity(
-        self, campaign_id, entity_type, entity_id, related=False, cache=False
+        self,
+        campaign_id,
+        entity_type,
+        entity_id,
+        related=False,
+        background=False,
     ):
         # Move privacy checking into here?
-        if related and cache:
-            raise ValueError(
-                "The related and cache parameters cannot both be"
-                " true as the cache lacks this information."
-            )
-        elif related:
-            entity_id = f"{entity_id}?related=1"
-        elif cache:
-            cached_entity = await self._check_cache(campaign_id, entity_type, entity_id)
-            if cached_entity is not None:
-                return cached_entity
-
-        async with self.session.get(
-            f"{REQUEST_PATH}campaigns/{campaign_id}/{entity_type}/{entity_id}"
-        ) as r:
-            if not await self._verify_response(r):
-                return None
-            j = await r.json()
+        cls = ENTITY_CLASSES.get(entity_type)
+        if cls is None:
+            self.log.debug(f"Invalid entity type {entity_type}")
+            return None
+
+        # Count views so the popular entities can be prefetched
+        if not background:
+            views = self._views.setdefault(campaign_id, Counter())
+            views[(entity_type, entity_id, related)] += 1
+
+        # Recently viewed entities are served from memory, or revalidated
+        # so an unchanged entity doesn't cost a full download
+        key = (campaign_id, entity_type, entity_id, related)
+        entity, fresh = self.full_cache.get(key)
+        if fresh:
+            return entity
+
+        r = await self._get(
+            f"{REQUEST_PATH}campaigns/{campaign_id}/{entity_type}/{entity_id}",
+            params={"related": 1} if related else None,
+            headers=self.full_cache.validators(key) if entity is not None else None,
+            background=background,
+        )
+        if r is not None and r.status == 304 and entity is not None:
+            self.full_cache.touch(key)
+            return entity
+        if r is not None and r.status == 404:
+            # Deleted since we cached it
+            self.cache.remove(campaign_id, entity_type, entity_id)
+            self.full_cache.invalidate(campaign_id, entity_type, entity_id)
+        if not self._verify_response(r):
+            return None
 
+        if self.log.isEnabledFor(logging.DEBUG):
             self.log.debug(
                 f"Get returned from {r.url} with status code {r.status}."
-                "Body follows."
+                f" Body follows.\n{r.json}"
             )
-            self.log.debug(j)
-
-            if entity_type == "locations":
-                return Location(campaign_id, j["data"])
-            elif entity_type == "characters":
-                return Character(campaign_id, j["data"])
-            elif entity_type == "organisations":
-                return Organisation(campaign_id, j["data"])
-            elif entity_type == "items":
-                return Item(campaign_id, j["data"])
-            elif entity_type == "families":
-                return Family(campaign_id, j["data"])
-            elif entity_type == "quests":
-                return Quest(campaign_id, j["data"])
-            elif entity_type == "events":
-                return Event(campaign_id, j["data"])
-            elif entity_type == "notes":
-                return Note(campaign_id, j["data"])
-            elif entity_type == "calendars":
-                return Calendar(campaign_id, j["data"])
-            elif entity_type == "tags":
-                return Tag(campaign_id, j["data"])
-            elif entity_type == "journals":
-                return Journal(campaign_id, j["data"])
-            elif entity_type == "races":
-                return Race(campaign_id, j["data"])
-            elif entity_type == "abilities":
-                return Ability(campaign_id, j["data"])
-            elif entity_type == "creatures":
-                return Creature(campaign_id, j["data"])
-            else:
-                self.log.debug(f"Invalid entity type for request {r.url} in return {j}")
-                return None
+
+        entity = cls(campaign_id, r.json["data"])
+        self.full_cache.put(key, entity, r.headers)
+        return entity
 
     async def _get_diceroll(self, campaign_id, diceroll_id):
         # TODO: I think dice rolls are broken right now. Report bug.
         # TODO: Search by name
-        async with self.session.get(
+        r = await self._get(
             f"{REQUEST_PATH}campaigns/{campaign_id}/dice_rolls/{diceroll_id}"
-        ) as r:
-            j = await r.json()
-            return DiceRoll(campaign_id, j["data"])
-
-    async def _cache_entities(self, campaign_id):
-        # TODO: LastSync, expiry, update
-        await self._cache_entity_by_type(campaign_id, "characters")
-        await self._cache_entity_by_type(campaign_id, "locations")
-        await self._cache_entity_by_type(campaign_id, "items")
-        await self._cache_entity_by_type(campaign_id, "organisations")
-        await self._cache_entity_by_type(campaign_id, "families")
-        await self._cache_entity_by_type(campaign_id, "quests")
-        await self._cache_entity_by_type(campaign_id, "notes")
-        await self._cache_entity_by_type(campaign_id, "events")
-        await self._cache_entity_by_type(campaign_id, "calendars")
-        await self._cache_entity_by_type(campaign_id, "journals")
-        await self._cache_entity_by_type(campaign_id, "tags")
-        await self._cache_entity_by_type(campaign_id, "races")
-        await self._cache_entity_by_type(campaign_id, "abilities")
-        await self._cache_entity_by_type(campaign_id, "creatures")
-
-    async def _cache_entity_by_type(self, campaign_id, entity_type: str):
-        # API will only load 15-100 entities at a time.
-        # Increment the page and load more if needed
-        done = False
-        page = 1
-
-        if entity_type not in CACHE:
-            CACHE[entity_type] = {}
-
-        while not done:
-            async with self.session.get(
-                "{base_url}campaigns/"
-                "{campaign_id}"
-                "/{entity_type}"
-                "?page={page}".format(
-                    base_url=REQUEST_PATH,
-                    campaign_id=campaign_id,
-                    entity_type=entity_type,
-                    page=page,
+        )
+        if not self._verify_response(r):
+            return None
+        return DiceRoll(campaign_id, r.json["data"])
+
+    async def _cache_entities(self, campaign_id, progress=None):
+        """Cache every entity type concurrently.
+
+        Requests are paced by the rate limiter, so this is as fast as the
+        quota allows. Returns the number of entities loaded, the time taken
+        in seconds and whether every type loaded. The campaign only counts
+        as synced if they all did. ``progress`` is an optional coroutine
+        function called with the number of finished types and the total."""
+        start = time.monotonic()
+        sync = _utc_timestamp()
+        done = 0
+        loaded = 0
+        complete = True
+
+        async def cache_type(entity_type):
+            nonlocal done, loaded, complete
+            count, ok = await self._cache_entity_by_type(campaign_id, entity_type)
+            loaded += count
+            complete = complete and ok
+            done += 1
+            if progress is not None:
+                await progress(done, len(ENTITY_TYPES))
+
+        await asyncio.gather(*(cache_type(t) for t in ENTITY_TYPES.values()))
+        if complete:
+            self.cache.set_last_sync(campaign_id, sync)
+            await self._save_snapshot(campaign_id)
+        return loaded, time.monotonic() - start, complete
+
+    async def _sync_entities(self, campaign_id):
+        """Update the cache with entities changed since the last sync.
+
+        The entities endpoint tells us which types have changed, then only
+        those types are fetched. Returns the number of entities updated."""
+        since = self.cache.last_sync(campaign_id)
+        if since is None:
+            loaded, _, _ = await self._cache_entities(campaign_id)
+            return loaded
+
+        sync = None
+        changed = set()
+        try:
+            async for j in self._iter_pages(
+                f"{REQUEST_PATH}campaigns/{campaign_id}/entities",
+                {"lastSync": since},
+                background=True,
+            ):
+                sync = sync or j.get("sync")
+                for data in j["data"]:
+                    if data.get("type") in ENTITY_TYPES:
+                        changed.add(ENTITY_TYPES[data["type"]])
+        except KankaError as e:
+            self.log.warning(f"Unable to sync campaign {campaign_id}: {e}")
+            return 0
+        sync = sync or _utc_timestamp()
+
+        results = await asyncio.gather(
+            *(self._cache_entity_by_type(campaign_id, t, since) for t in changed)
+        )
+        # If a type failed, the next sync fetches its changes again
+        if all(complete for _, complete in results):
+            self.cache.set_last_sync(campaign_id, sync)
+            if changed:
+                await self._save_snapshot(campaign_id)
+        return sum(count for count, _ in results)
+
+    async def _sync_loop(self):
+        await self.bot.wait_until_red_ready()
+        while True:
+            interval = await self.config.sync_interval()
+            await sleep(max(interval, 1) * 60)
+            if not interval:
+                continue
+            for campaign_id in self.cache.campaigns():
+                # Campaigns never loaded, or whose entities expired, are
+                # loaded in full
+                try:
+                    await self._ensure_session()
+                    updated = await self._sync_entities(campaign_id)
+                    self.log.debug(f"Synced {updated} entities in {campaign_id}.")
+                except Exception:
+                    # Keep syncing the other campaigns, and try again next time
+                    self.log.exception(f"Error syncing campaign {campaign_id}.")
+
+    async def _prefetch_loop(self):
+        await self.bot.wait_until_red_ready()
+        while True:
+            await sleep(PREFETCH_INTERVAL)
+            for campaign_id in list(self._views):
+                if campaign_id not in self.cache.campaigns():
+                    del self._views[campaign_id]
+                    continue
+                if not self.limiter.idle():
+                    break
+                try:
+                    await self._prefetch(campaign_id)
+                except Exception:
+                    # Prefetching is only an optimisation, keep going
+                    self.log.exception(f"Error prefetching campaign {campaign_id}.")
+
+    async def _prefetch(self, campaign_id):
+        """Fetch the campaign's most viewed entities and the entities they
+        link to, so their first view is served from memory.
+
+        Only entities missing from the caches or gone stale are fetched,
+        as background requests, up to PREFETCH_REQUESTS of them in all.
+        Stale entities are revalidated, which is usually a cheap 304. View
+        counts are then halved so the popular set follows the current
+        session."""
+        views = self._views[campaign_id]
+        budget = PREFETCH_REQUESTS
+
+        async def warm(entity_type, id, related):
+            nonlocal budget
+            entity, fresh = self.full_cache.peek(
+                (campaign_id, entity_type, id, related)
+            )
+            if not fresh and budget > 0:
+                budget -= 1
+                entity = (
+                    await self._get_entity(
+                        campaign_id, entity_type, id, related, background=True
+                    )
+                    or entity
                 )
-            ) as r:
-                if r.status == 429:
-                    self.log.info("Exceeded Kanka's ratelimit. Sleeping.")
-                    await sleep(30)
+            return entity
+
+        for (entity_type, id, related), _ in views.most_common(PREFETCH_ENTITIES):
+            entity = await warm(entity_type, id, related)
+            if entity is None:
+                continue
+            for ref in entity.references():
+                ref_type, ref_id = ref
+                if ref_type == "entities" or ref_id is None:
+                    # Quest elements only have entity IDs, skip them
+                    continue
+                cls = ENTITY_CLASSES.get(ref_type)
+                if cls is None:
+                    continue
+                linked = await warm(ref_type, ref_id, cls.fetch_related)
+                if linked is None or budget <= 0:
                     continue
-                elif not await self._verify_response(r):
-                    self.log.warning("Error while caching, aborting.")
-                    return
+                missing = [
+                    ref
+                    for ref in dict.fromkeys(linked.references())
+                    if ref[1] is not None and self._lookup(campaign_id, ref) is None
+                ][:budget]
+                budget -= len(missing)
+                await self._resolve(campaign_id, missing, background=True)
+            if budget <= 0:
+                break
+
+        self._views[campaign_id] = Counter(
+            {key: count // 2 for key, count in views.items() if count > 1}
+        )
 
-                j = await r.json()
+    async def _fetch_page(self, url, page, params=None, background=False):
+        """Get one page of a list endpoint."""
+        params = {**params, "page": page} if params else {"page": page}
+        r = await self._get(url, params, background=background)
+        if not self._verify_response(r):
+            return None
+        return r.json
 
-                # Use meta element page count instead?
-                if len(j["data"]) == 0:
-                    done = True
+    async def _iter_pages(
+        self, url, params=None, page_size=PAGE_SIZE, background=False
+    ):
+        """Yield each page of a list endpoint in turn.
+
+        The next page is requested while the current one is being used.
+        Stops at the last page given by the page's meta or links. Raises
+        KankaError if a page can't be fetched."""
+        params = {**params, "limit": page_size} if params else {"limit": page_size}
+        page = 1
+        task = asyncio.ensure_future(self._fetch_page(url, page, params, background))
+        try:
+            while task is not None:
+                j = await task
+                task = None
+                if j is None:
+                    raise KankaError(f"Unable to get page {page} of {url}")
+                meta = j.get("meta") or {}
+                if "last_page" in meta:
+                    more = page < meta["last_page"]
                 else:
-                    for i in range(len(j["data"])):
-                        entity = Entity(campaign_id, j["data"][i])
-                        entity.entity_type = entity_type
-                        CACHE[entity_type][entity.id] = entity
+                    more = bool(j.get("links", {}).get("next"))
+                if more:
                     page += 1
+                    task = asyncio.ensure_future(
+                        self._fetch_page(url, page, params, background)
+                    )
+                yield j
+        finally:
+            if task is not None:
+                task.cancel()
+
+    async def _iter_entities(
+        self, url, params=None, page_size=PAGE_SIZE, background=False
+    ):
+        """Yield each entity from a list endpoint, see _iter_pages."""
+        async for j in self._iter_pages(url, params, page_size, background):
+            for data in j["data"]:
+                yield data
+
+    async def _cache_entity_by_type(self, campaign_id, entity_type: str, since=None):
+        # Cache misses for the same type at once share one load
+        return await self._shared(
+            ("type", campaign_id, entity_type, since),
+            lambda: self._load_entity_type(campaign_id, entity_type, since),
+        )
 
-            await sleep(2)
-
-    async def _parse_entry(self, ctx, parent):
-        # get the entity's entry
-        entry = parent.entry
-
+    async def _load_entity_type(self, campaign_id, entity_type, since):
+        # API will only load 15-100 entities at a time.
+        # If since is given only entities changed after then are fetched.
+        # Returns the number loaded and whether every page was.
+        params = {"lastSync": since} if since else None
+        loaded = 0
+        changed = False
+        complete = True
+        try:
+            # Bulk loads give way to commands
+            async for data in self._iter_entities(
+                f"{REQUEST_PATH}campaigns/{campaign_id}/{entity_type}",
+                params,
+                background=True,
+            ):
+                changed = True
+                self.full_cache.invalidate(
+                    campaign_id, entity_type, data.get("id"), data.get("updated_at")
+                )
+                if data.get("deleted_at"):
+                    self.cache.remove(campaign_id, entity_type, data.get("id"))
+                    continue
+                self.cache.put(CachedEntity(campaign_id, entity_type, data))
+                loaded += 1
+        except KankaError as e:
+            self.log.warning(f"Error while caching {entity_type}, aborting: {e}")
+            complete = False
+        if changed:
+            self.embed_cache.clear(campaign_id)
+        return loaded, complete
+
+    async def _parse_entry(self, settings, parent):
         # Discord limits the embed to 2048 characters,
-        # so lets save some work by cutting the length down to size
+        # so lets save some work by only converting what we need and
+        # cutting the length down to size.
         # at the end, we will create a "Read More" link to pretty things up.
+        # Long entries take a while to convert, so do it off the event loop.
+        loop = asyncio.get_running_loop()
+        entry = await loop.run_in_executor(self._markdown, parent.entry_preview, 2047)
         if len(entry) > 2047:
             entry = entry[:2047]
 
-        url = "https://kanka.io/{lang}/campaign/".format(lang=await self._language(ctx))
+        url = "https://kanka.io/{lang}/campaign/".format(lang=settings.language)
         entry = entry.replace("https://kanka.io/campaign/", url)
 
         # Entry length limit due to Discord embed rules
         if len(entry) > 1900:
             entry = entry[:1900] + "... [Read more.]({link})".format(
-                link=parent.link(await self._language(ctx), pretty=False)
+                link=parent.link(settings.language, pretty=False)
             )
 
         return entry
 
-    async def _check_cache(self, campaign_id, entity_type, entity_id):
-        # check cache for ID of entity.
-        if entity_type not in CACHE or entity_id not in CACHE[entity_type]:
-            # if the cache has not been loaded, or we are missing this ID,
-            # try to reload the IDs
-            await self._cache_entity_by_type(campaign_id, entity_type)
-            if entity_type not in CACHE or entity_id not in CACHE[entity_type]:
-                # if there is still a problem, give up
+    async def _resolve(self, campaign_id, refs, background=False):
+        """Get (entity_type, id) pairs as cached entities.
+
+        Anything not in the cache is fetched concurrently. The "entities"
+        type looks entities up by their entity ID instead. Returns a dict
+        from each pair to the entity, or None if it couldn't be found."""
+        related = {}
+        missing = []
+        for ref in dict.fromkeys(refs):
+            if ref[1] is None:
+                continue
+            related[ref] = self._lookup(campaign_id, ref)
+            if related[ref] is None:
+                missing.append(ref)
+
+        semaphore = asyncio.Semaphore(RESOLVE_CONCURRENCY)
+
+        async def fetch(ref):
+            async with semaphore:
+                related[ref] = await self._fetch_cached_entity(
+                    campaign_id, *ref, background
+                )
+
+        await asyncio.gather(*(fetch(ref) for ref in missing))
+        return related
+
+    def _lookup(self, campaign_id, ref):
+        """An (entity_type, id) pair from the cache, or None."""
+        entity_type, id = ref
+        if entity_type == "entities":
+            return self.cache.get_by_entity_id(campaign_id, id)
+        return self.cache.get(campaign_id, entity_type, id)
+
+    async def _fetch_cached_entity(
+        self, campaign_id, entity_type, id, background=False
+    ):
+        """Get a single entity from the API and add it to the cache."""
+        r = await self._get(
+            f"{REQUEST_PATH}campaigns/{campaign_id}/{entity_type}/{id}",
+            background=background,
+        )
+        if r is not None and r.status == 404:
+            self.cache.remove(campaign_id, entity_type, id)
+        if not self._verify_response(r):
+            return None
+        data = r.json["data"]
+
+        if entity_type == "entities":
+            # The entities endpoint swaps the IDs around
+            entity_type = ENTITY_TYPES.get(data.get("type"))
+            if entity_type is None:
                 return None
-        # the ID has been loaded
-        return CACHE[entity_type][entity_id]
+            data = {**data, "id": data.get("child_id"), "entity_id": data.get("id")}
+        entity = CachedEntity(campaign_id, entity_type, data)
+        self.cache.put(entity)
+        return entity
 
     async def _search(self, cmpgn_id, query, entity_type=None):
-        async with self.session.get(
-            f"{REQUEST_PATH}campaigns/{cmpgn_id}/search/{query}"
-        ) as r:
-            if not await self._verify_response(r):
-                return None
+        def found(entity):
+            return {
+                "id": entity.id,
+                "entity_id": entity.entity_id,
+                "name": entity.name,
+                "type": ENTITY_CLASSES[entity.entity_type].api_type,
+            }
 
-            j = await r.json()
-            self.log.debug(
-                f"Get returned from {r.url} with status code {r.status}."
-                "Body follows."
+        # Answer exact and prefix matches from the cache, the search
+        # endpoint is slow. A fuzzy match could be hiding an entity added
+        # since the last sync, so those are only used if the API has
+        # nothing or can't be reached.
+        cached = entity_type is None or entity_type in ENTITY_TYPES
+        if cached:
+            entity = self.cache.search(
+                cmpgn_id, query, ENTITY_TYPES.get(entity_type), fuzzy=False
+            )
+            if entity is not None:
+                return found(entity)
+
+        result = await self._search_api(cmpgn_id, query, entity_type)
+        if result is None and cached:
+            entity = self.cache.search(cmpgn_id, query, ENTITY_TYPES.get(entity_type))
+            if entity is not None:
+                return found(entity)
+        return result
+
+    async def _search_api(self, cmpgn_id, query, entity_type=None):
+        if entity_type in ENTITY_TYPES:
+            # The type's own list endpoint filters by name for us
+            endpoint = ENTITY_TYPES[entity_type]
+            url = f"{REQUEST_PATH}campaigns/{cmpgn_id}/{endpoint}"
+            j = await self._fetch_page(url, 1, {"name": query})
+            if not j or not j.get("data"):
+                return None
+            # The filter matches anywhere in the name, prefer an exact match
+            folded = query.casefold()
+            result = next(
+                (e for e in j["data"] if e.get("name", "").casefold() == folded),
+                j["data"][0],
             )
-            self.log.debug(j)
-
-            # if they've specified a type, look for it
-            if entity_type and j.get("data"):
-                for result in j.get("data"):
-                    if result.get("type") == entity_type:
-                        return result
-                # if the loop ends with no matches the search couldn't find it
+            return {**result, "type": entity_type}
+
+        # Otherwise walk the search results until one has the right type
+        url = f"{REQUEST_PATH}campaigns/{cmpgn_id}/search/{query}"
+        page = 1
+        while True:
+            j = await self._fetch_page(url, page)
+            if not j or not j.get("data"):
                 return None
-            elif j.get("data"):  # if not just blindly grab the first result
-                return j["data"][0]
-            elif "data" in j:  # if the search results are empty report no match
+            for result in j["data"]:
+                if entity_type is None or result.get("type") == entity_type:
+                    return result
+            if not j.get("links", {}).get("next"):
                 return None
+            page += 1
 
-    async def _check_private(self, guild, entity):
-        return entity.is_private and await self.config.guild(guild).hide_private()
+    def _check_private(self, settings, entity):
+        return entity.is_private and settings.hide_private
 
     async def _process_display_input(self, ctx, input, entity_type, alert=True):
         try:
@@ -555,22 +1813,24 @@ class KankaView(commands.Cog):
                     await ctx.send(MSG_ENTITY_NOT_FOUND)
                 return None
 
-    async def _display_entity(self, ctx, entity: Entity, alert=True):
+    async def _display_entity(self, ctx, settings, entity: Entity, alert=True):
         """Generate basic embed for any entity type"""
         # TODO: Attributes and relations
         if entity is None:
             await ctx.send(MSG_ENTITY_NOT_FOUND)
-            return None
-        elif await self._check_private(ctx.guild, entity):
+            return None, None
+        elif self._check_private(settings, entity):
             if alert:
                 await ctx.send(MSG_ENTITY_NOT_FOUND)
-            return None
+            return None, None
 
-        lang = await self._language(ctx)
+        # Everything the embed links to, resolved in one go
+        related = await self._resolve(entity.campaign_id, entity.references())
+        lang = settings.language
 
         em = discord.Embed(
             title=f"{entity.name} :lock:" if entity.is_private else entity.name,
-            description=await self._parse_entry(ctx, entity),
+            description=await self._parse_entry(settings, entity),
             url=entity.link(lang=lang, pretty=False),
             colour=discord.Color.blue(),
         )
@@ -583,20 +1843,63 @@ class KankaView(commands.Cog):
                 value += f"[{file_name}]({entity.files[file_name]}), "
             em.add_field(name="Files", value=value[0 : len(value) - 2])
 
-        if entity.tags:
-            tags = []
-            for tag_id in entity.tags:
-                tag = await self._get_entity(
-                    entity.campaign_id, "tags", tag_id, cache=True
-                )
-                if not await self._check_private(ctx.guild, tag):
-                    tags.append(tag.link(lang))
-            if tags:  # Hide tag field when all are private
-                em.add_field(name="Tags", value=", ".join(tags))
+        # Hide tag field when all are private
+        self._add_links(
+            settings, em, related, "Tags", [("tags", t) for t in entity.tags or []]
+        )
+
+        return em, related
+
+    def _add_links(self, settings, em, related, name, refs):
+        """Add a field linking to the related entities that exist and may be
+        shown. The field is left out if there are none."""
+        links = []
+        for ref in refs:
+            entity = related.get(ref)
+            if entity is not None and not self._check_private(settings, entity):
+                links.append(entity.link(settings.language))
+        if links:
+            em.add_field(name=name, value=", ".join(links))
+
+    async def _load_cache_with_progress(self, ctx, campaign_id):
+        msg = await ctx.send("Loading Entity info...")
+
+        async def progress(done, total):
+            await msg.edit(content=f"Loading Entity info... {done}/{total} types.")
+
+        loaded, elapsed, complete = await self._cache_entities(campaign_id, progress)
+        if complete:
+            await ctx.send(f"{loaded} Entities loaded in {elapsed:.1f} seconds.")
+        else:
+            await ctx.send(
+                f"{loaded} Entities loaded in {elapsed:.1f} seconds, but some "
+                "could not be loaded. They will be tried again at the next sync."
+            )
 
-        return em
+    def _embed_key(self, settings, campaign_id, entity_type, id, updated_at):
+        return (
+            campaign_id,
+            entity_type,
+            id,
+            updated_at,
+            settings.language,
+            settings.hide_private,
+        )
+
+    async def _send_cached(self, ctx, settings, campaign_id, entity_type, id):
+        """Send the embed from an earlier display of this version of the
+        entity, if there is one. Returns True if it was sent."""
+        cached = self.cache.get(campaign_id, entity_type, id)
+        if cached is None:
+            return False
+        key = self._embed_key(settings, campaign_id, entity_type, id, cached.updated_at)
+        em = self.embed_cache.get(key)
+        if em is None:
+            return False
+        await ctx.send(embed=em)
+        return True
 
-    async def _send(self, ctx, em):
+    async def _send(self, ctx, em, settings=None, entity=None):
         # Strip out empty fields for tidiness
         i = 0
         while i < len(em.fields):
@@ -605,6 +1908,15 @@ class KankaView(commands.Cog):
                 em.remove_field(i)
             else:
                 i += 1
+        if entity is not None:
+            key = self._embed_key(
+                settings,
+                entity.campaign_id,
+                entity.entity_type,
+                entity.id,
+                entity.updated_at,
+            )
+            self.embed_cache.put(key, em)
         await ctx.send(embed=em)
 
     @commands.group(name="kanka")
@@ -643,11 +1955,12 @@ class KankaView(commands.Cog):
         commands."""
         # TODO: Add alias and name support
         campaign = await self._get_campaign(id)
+        settings = await self._settings(ctx.guild)
         em = discord.Embed(
             title=campaign.name,
-            description=await self._parse_entry(ctx, campaign),
+            description=await self._parse_entry(settings, campaign),
             url="https://kanka.io/{lang}/campaign/{id}".format(
-                lang=await self._language(ctx), id=campaign.id
+                lang=settings.language, id=campaign.id
             ),
             colour=discord.Color.blue(),
         )
@@ -662,15 +1975,19 @@ class KankaView(commands.Cog):
             name="Updated At", value=campaign.updated_at[:-11].replace("T", " ")
         )
         await self.config.guild(ctx.guild).active.set(id)
+        self._forget_settings(ctx.guild)
         await ctx.send("Active campaign set.", embed=em)
 
-        await ctx.send("Loading Entity info...")
-        CACHE.clear()
-        await self._cache_entities(id)
-        length = 0
-        for value in CACHE.values():
-            length += len(value)
-        await ctx.send(str(length) + " Entities loaded.")
+        # Other guilds may already be using this campaign, or it may have
+        # been saved to disk last time the bot ran
+        self.cache.acquire(ctx.guild.id, id)
+        await self._restore_campaign(id)
+        # Single entities may have been cached for display without the
+        # campaign ever being loaded
+        if self.cache.last_sync(id) is not None:
+            await ctx.send(f"{self.cache.count(id)} Entities already loaded.")
+        else:
+            await self._load_cache_with_progress(ctx, id)
 
     @kanka.command(name="character")
     async def display_character(self, ctx, input, alert=True):
@@ -679,17 +1996,16 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        char = await self._get_entity(
-            await self._active(ctx), "characters", id, related=True
-        )
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "characters", id):
+            return True
+        char = await self._get_entity(campaign_id, "characters", id, related=True)
 
-        em = await self._display_entity(ctx, char, alert)
+        em, related = await self._display_entity(ctx, settings, char, alert)
         if em is None:
             return False
 
-        lang = await self._language(ctx)
-        cmpgn_id = char.campaign_id
-
         em.add_field(name="Title", value=char.title)
         em.add_field(name="Age", value=char.age)
         em.add_field(name="Gender", value=char.sex)
@@ -699,26 +2015,13 @@ class KankaView(commands.Cog):
         else:
             em.add_field(name="Status", value="Alive")
 
-        if char.race_id:
-            race = await self._get_entity(cmpgn_id, "races", char.race_id)
-            if not await self._check_private(ctx.guild, race):
-                em.add_field(name="Race", value=race.link(lang))
-
-        if char.location_id is not None:
-            location = await self._get_entity(
-                cmpgn_id, "locations", char.location_id, cache=True
-            )
-            if not await self._check_private(ctx.guild, location):
-                em.add_field(name="Location", value=location.link(lang))
-
-        if char.family_id:
-            family = await self._get_entity(
-                cmpgn_id, "families", char.family_id, cache=True
-            )
-            if not await self._check_private(ctx.guild, family):
-                em.add_field(name="Family", value=family.link(lang))
+        self._add_links(settings, em, related, "Race", [("races", char.race_id)])
+        self._add_links(
+            settings, em, related, "Location", [("locations", char.location_id)]
+        )
+        self._add_links(settings, em, related, "Family", [("families", char.family_id)])
 
-        await self._send(ctx, em)
+        await self._send(ctx, em, settings, char)
         return True
 
     @kanka.command(name="location")
@@ -728,16 +2031,17 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        location = await self._get_entity(
-            await self._active(ctx), "locations", id, True
-        )
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "locations", id):
+            return True
+        location = await self._get_entity(campaign_id, "locations", id, True)
 
-        em = await self._display_entity(ctx, location, alert)
+        em, related = await self._display_entity(ctx, settings, location, alert)
         if em is None:
             return False
 
-        lang = await self._language(ctx)
-        cmpgn_id = location.campaign_id
+        lang = settings.language
 
         # TODO: Add support for new map entity then remove support for old
         if location.map is not None:  # Old style map only
@@ -748,13 +2052,15 @@ class KankaView(commands.Cog):
                 ),
             )
 
-        if location.parent_location_id is not None:
-            parent = await self._get_entity(
-                cmpgn_id, "locations", location.parent_location_id, cache=True
-            )
-            em.add_field(name="Parent Location", value=parent.link(lang))
+        self._add_links(
+            settings,
+            em,
+            related,
+            "Parent Location",
+            [("locations", location.parent_location_id)],
+        )
 
-        await ctx.send(embed=em)
+        await self._send(ctx, em, settings, location)
         return True
 
     @kanka.command(name="event")
@@ -764,24 +2070,23 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        event = await self._get_entity(await self._active(ctx), "events", id)
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "events", id):
+            return True
+        event = await self._get_entity(campaign_id, "events", id)
 
-        em = await self._display_entity(ctx, event, alert)
+        em, related = await self._display_entity(ctx, settings, event, alert)
         if em is None:
             return False
 
-        lang = await self._language(ctx)
-        cmpgn_id = event.campaign_id
-
         em.add_field(name="Date", value=event.date)
 
-        if event.location_id is not None:
-            location = await self._get_entity(
-                cmpgn_id, "locations", event.location_id, cache=True
-            )
-            em.add_field(name="Location", value=location.link(lang))
+        self._add_links(
+            settings, em, related, "Location", [("locations", event.location_id)]
+        )
 
-        await self._send(ctx, em)
+        await self._send(ctx, em, settings, event)
         return True
 
     @kanka.command(name="family")
@@ -791,28 +2096,28 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        family = await self._get_entity(await self._active(ctx), "families", id)
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "families", id):
+            return True
+        family = await self._get_entity(campaign_id, "families", id)
 
-        em = await self._display_entity(ctx, family, alert)
+        em, related = await self._display_entity(ctx, settings, family, alert)
         if em is None:
             return False
 
-        lang = await self._language(ctx)
-        cmpgn_id = family.campaign_id
-
-        if family.location_id is not None:
-            location = await self._get_entity(
-                cmpgn_id, "locations", family.location_id, cache=True
-            )
-            em.add_field(name="Location", value=location.link(lang))
-
-        if family.parent_family_id is not None:
-            parent = await self._get_entity(
-                cmpgn_id, "families", family.parent_family_id, cache=True
-            )
-            em.add_field(name="Parent Family", value=parent.link(lang))
+        self._add_links(
+            settings, em, related, "Location", [("locations", family.location_id)]
+        )
+        self._add_links(
+            settings,
+            em,
+            related,
+            "Parent Family",
+            [("families", family.parent_family_id)],
+        )
 
-        await self._send(ctx, em)
+        await self._send(ctx, em, settings, family)
         return True
 
     @kanka.command(name="calendar")
@@ -822,9 +2127,13 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        calendar = await self._get_entity(await self._active(ctx), "calendars", id)
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "calendars", id):
+            return True
+        calendar = await self._get_entity(campaign_id, "calendars", id)
 
-        em = await self._display_entity(ctx, calendar, alert)
+        em, _ = await self._display_entity(ctx, settings, calendar, alert)
         if em is None:
             return False
 
@@ -835,7 +2144,7 @@ class KankaView(commands.Cog):
         em.add_field(name="Length", value=str(calendar.get_year_length()))
         em.add_field(name="Days", value=calendar.get_weekdays())
 
-        await self._send(ctx, em)
+        await self._send(ctx, em, settings, calendar)
         return True
 
     @kanka.command(name="diceroll")
@@ -854,7 +2163,7 @@ class KankaView(commands.Cog):
                     await ctx.send(MSG_ENTITY_NOT_FOUND)
                 return False
         diceroll = await self._get_diceroll(await self._active(ctx), diceroll_id)
-        if not await self._check_private(ctx.guild, diceroll):
+        if not self._check_private(await self._settings(ctx.guild), diceroll):
             em = discord.Embed(
                 title=diceroll.name,
                 description=diceroll.parameters,
@@ -880,28 +2189,24 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        item = await self._get_entity(await self._active(ctx), "items", id)
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "items", id):
+            return True
+        item = await self._get_entity(campaign_id, "items", id)
 
-        em = await self._display_entity(ctx, item, alert)
+        em, related = await self._display_entity(ctx, settings, item, alert)
         if em is None:
             return False
 
-        lang = await self._language(ctx)
-        cmpgn_id = item.campaign_id
-
-        if item.character_id is not None:
-            owner = await self._get_entity(
-                cmpgn_id, "characters", item.character_id, cache=True
-            )
-            em.add_field(name="Owner", value=owner.link(lang))
-
-        if item.location_id is not None:
-            location = await self._get_entity(
-                cmpgn_id, "locations", item.location_id, cache=True
-            )
-            em.add_field(name="Location", value=location.link(lang))
+        self._add_links(
+            settings, em, related, "Owner", [("characters", item.character_id)]
+        )
+        self._add_links(
+            settings, em, related, "Location", [("locations", item.location_id)]
+        )
 
-        await self._send(ctx, em)
+        await self._send(ctx, em, settings, item)
         return True
 
     @kanka.command(name="journal")
@@ -911,25 +2216,24 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        journal = await self._get_entity(await self._active(ctx), "journals", id)
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "journals", id):
+            return True
+        journal = await self._get_entity(campaign_id, "journals", id)
 
-        em = await self._display_entity(ctx, journal, alert)
+        em, related = await self._display_entity(ctx, settings, journal, alert)
         if em is None:
             return False
 
-        lang = await self._language(ctx)
-        cmpgn_id = journal.campaign_id
-
         if journal.date is not None:
             em.add_field(name="Date", value=journal.date)
 
-        if journal.character_id is not None:
-            author = await self._get_entity(
-                cmpgn_id, "journals", journal.character_id, cache=True
-            )
-            em.add_field(name="Author", value=author.link(lang))
+        self._add_links(
+            settings, em, related, "Author", [("characters", journal.character_id)]
+        )
 
-        await self._send(ctx, em)
+        await self._send(ctx, em, settings, journal)
         return True
 
     @kanka.command(name="organisation")
@@ -940,37 +2244,30 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        organisation = await self._get_entity(
-            await self._active(ctx), "organisations", id
-        )
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "organisations", id):
+            return True
+        organisation = await self._get_entity(campaign_id, "organisations", id)
 
-        em = await self._display_entity(ctx, organisation, alert)
+        em, related = await self._display_entity(ctx, settings, organisation, alert)
         if em is None:
             return False
 
-        lang = await self._language(ctx)
-        cmpgn_id = organisation.campaign_id
-
-        if organisation.members:
-            members = []
-            for m in organisation.members:
-                member = await self._get_entity(
-                    cmpgn_id, "characters", m.get("character_id"), cache=True
-                )
-                if not await self._check_private(ctx.guild, member):
-                    members.append(member.link(lang))
-            if members:  # Hide field when all members are private
-                em.add_field(name="Members", value=", ".join(members))
-                # The members information in organisation.members
-                # includes an is_private field - consult that?
-
-        if organisation.location_id is not None:
-            location = await self._get_entity(
-                cmpgn_id, "locations", organisation.location_id, cache=True
-            )
-            em.add_field(name="Location", value=location.link(lang))
+        # The members information in organisation.members
+        # includes an is_private field - consult that?
+        self._add_links(
+            settings,
+            em,
+            related,
+            "Members",
+            [("characters", m.get("character_id")) for m in organisation.members or []],
+        )
+        self._add_links(
+            settings, em, related, "Location", [("locations", organisation.location_id)]
+        )
 
-        await self._send(ctx, em)
+        await self._send(ctx, em, settings, organisation)
         return True
 
     @kanka.command(name="quest")
@@ -981,29 +2278,28 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        quest: Quest = await self._get_entity(await self._active(ctx), "quests", id)
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "quests", id):
+            return True
+        quest: Quest = await self._get_entity(campaign_id, "quests", id)
 
-        em = await self._display_entity(ctx, quest, alert)
+        em, related = await self._display_entity(ctx, settings, quest, alert)
         if em is None:
             return False
 
-        lang = await self._language(ctx)
-        cmpgn_id = quest.campaign_id
+        lang = settings.language
 
-        if quest.character_id is not None:
-            instigator = await self._get_entity(
-                cmpgn_id, "characters", quest.character_id, cache=True
-            )
-            em.add_field(name="Instigator", value=instigator.link(lang))
+        self._add_links(
+            settings, em, related, "Instigator", [("characters", quest.character_id)]
+        )
 
         em.add_field(name="Completed", value=quest.is_completed)
         em.add_field(name="Characters", value=quest.characters)
 
-        if quest.parent_quest_id is not None:
-            parent = await self._get_entity(
-                cmpgn_id, "quests", quest.parent_quest_id, cache=True
-            )
-            em.add_field(name="Parent Quest", value=parent.link(lang))
+        self._add_links(
+            settings, em, related, "Parent Quest", [("quests", quest.parent_quest_id)]
+        )
 
         if quest.elements:
             elements = []
@@ -1012,19 +2308,11 @@ class KankaView(commands.Cog):
                 url = None
 
                 if el.get("entity_id"):
-                    async with self.session.get(
-                        f"{REQUEST_PATH}campaigns/{cmpgn_id}/entities/{el['entity_id']}"
-                    ) as r:
-                        if not await self._verify_response(r):
-                            continue
-                        j = await r.json()
-                        j = j["data"]
-
-                        self.log.debug(f"Get from {r.url} with status {r.status}")
-                        self.log.debug(j)
-
-                        name = j["name"]
-                        url = j["child"]["urls"]["view"]
+                    entity = related.get(("entities", el["entity_id"]))
+                    if entity is None or self._check_private(settings, entity):
+                        continue
+                    name = entity.name
+                    url = entity.link(lang, pretty=False)
                 if el.get("name"):
                     name = el["name"]
 
@@ -1035,7 +2323,7 @@ class KankaView(commands.Cog):
             if elements:
                 em.add_field(name="Elements", value=", ".join(elements))
 
-        await self._send(ctx, em)
+        await self._send(ctx, em, settings, quest)
         return True
 
     @kanka.command(name="tag")
@@ -1046,20 +2334,19 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        tag = await self._get_entity(await self._active(ctx), "tags", id)
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "tags", id):
+            return True
+        tag = await self._get_entity(campaign_id, "tags", id)
 
-        em = await self._display_entity(ctx, tag, alert)
+        em, related = await self._display_entity(ctx, settings, tag, alert)
         if em is None:
             return False
 
-        lang = await self._language(ctx)
-        cmpgn_id = tag.campaign_id
+        self._add_links(settings, em, related, "Parent Tag", [("tags", tag.tag_id)])
 
-        if tag.tag_id is not None:
-            parent = await self._get_entity(cmpgn_id, "tags", tag.tag_id, cache=True)
-            em.add_field(name="Parent Tag", value=parent.link(lang))
-
-        await self._send(ctx, em)
+        await self._send(ctx, em, settings, tag)
         return True
 
     @kanka.command(name="note")
@@ -1069,13 +2356,17 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        note = await self._get_entity(await self._active(ctx), "notes", id)
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "notes", id):
+            return True
+        note = await self._get_entity(campaign_id, "notes", id)
 
-        em = await self._display_entity(ctx, note, alert)
+        em, _ = await self._display_entity(ctx, settings, note, alert)
         if em is None:
             return False
 
-        await self._send(ctx, em)
+        await self._send(ctx, em, settings, note)
         return True
 
     @kanka.command(name="race")
@@ -1085,22 +2376,21 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        race = await self._get_entity(await self._active(ctx), "races", id)
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "races", id):
+            return True
+        race = await self._get_entity(campaign_id, "races", id)
 
-        em = await self._display_entity(ctx, race, alert)
+        em, related = await self._display_entity(ctx, settings, race, alert)
         if em is None:
             return False
 
-        lang = await self._language(ctx)
-        cmpgn_id = race.campaign_id
-
-        if race.parent_race_id is not None:
-            parent = await self._get_entity(
-                cmpgn_id, "races", race.parent_race_id, cache=True
-            )
-            em.add_field(name="Parent Race", value=parent.link(lang))
+        self._add_links(
+            settings, em, related, "Parent Race", [("races", race.parent_race_id)]
+        )
 
-        await self._send(ctx, em)
+        await self._send(ctx, em, settings, race)
         return True
 
     @kanka.command(name="ability")
@@ -1110,25 +2400,28 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        ability = await self._get_entity(await self._active(ctx), "abilities", id)
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "abilities", id):
+            return True
+        ability = await self._get_entity(campaign_id, "abilities", id)
 
-        em = await self._display_entity(ctx, ability, alert)
+        em, related = await self._display_entity(ctx, settings, ability, alert)
         if em is None:
             return False
 
-        lang = await self._language(ctx)
-        cmpgn_id = ability.campaign_id
-
-        if ability.parent_ability_id is not None:
-            parent = await self._get_entity(
-                cmpgn_id, "abilities", ability.parent_ability_id, cache=True
-            )
-            em.add_field(name="Parent Ability", value=parent.link(lang))
+        self._add_links(
+            settings,
+            em,
+            related,
+            "Parent Ability",
+            [("abilities", ability.parent_ability_id)],
+        )
 
         if ability.charges is not None:
             em.add_field(name="Charges", value=ability.charges)
 
-        await self._send(ctx, em)
+        await self._send(ctx, em, settings, ability)
         return True
 
     @kanka.command(name="creature")
@@ -1138,35 +2431,32 @@ class KankaView(commands.Cog):
         if id is None:
             return False
 
-        creature: Creature = await self._get_entity(
-            await self._active(ctx), "creatures", id
-        )
+        campaign_id = await self._active(ctx)
+        settings = await self._settings(ctx.guild)
+        if await self._send_cached(ctx, settings, campaign_id, "creatures", id):
+            return True
+        creature: Creature = await self._get_entity(campaign_id, "creatures", id)
 
-        em = await self._display_entity(ctx, creature, alert)
+        em, related = await self._display_entity(ctx, settings, creature, alert)
         if em is None:
             return False
 
-        lang = await self._language(ctx)
-        cmpgn_id = creature.campaign_id
-
-        if creature.parent_creature_id is not None:
-            parent = await self._get_entity(
-                cmpgn_id, "creatures", creature.parent_creature_id, cache=True
-            )
-            em.add_field(name="Parent Creature", value=parent.link(lang))
-
-        if creature.locations:
-            locations = []
-            for loc_id in creature.locations:
-                loc: Location = await self._get_entity(
-                    creature.campaign_id, "locations", loc_id, cache=True
-                )
-                if not await self._check_private(ctx.guild, loc):
-                    locations.append(loc.link(lang))
-            if locations:
-                em.add_field(name="Locations", value=", ".join(locations))
+        self._add_links(
+            settings,
+            em,
+            related,
+            "Parent Creature",
+            [("creatures", creature.parent_creature_id)],
+        )
+        self._add_links(
+            settings,
+            em,
+            related,
+            "Locations",
+            [("locations", loc_id) for loc_id in creature.locations or []],
+        )
 
-        await self._send(ctx, em)
+        await self._send(ctx, em, settings, creature)
         return True
 
     @kanka.command(name="search")
@@ -1184,60 +2474,26 @@ class KankaView(commands.Cog):
 
         # We have to get the entity again
         # because the search endpoint gives truncated data
-        if entity_type == "character":
-            await self.display_character(ctx, id)
-            return
-        elif entity_type == "location":
-            await self.display_location(ctx, id)
-            return
-        elif entity_type == "organisation":
-            await self.display_organisation(ctx, id)
-            return
-        elif entity_type == "family":
-            await self.display_family(ctx, id)
-            return
-        elif entity_type == "calendar":
-            await self.display_calendar(ctx, id)
-            return
-        elif entity_type == "race":
-            await self.display_race(ctx, id)
-            return
-        elif entity_type == "quest":
-            await self.display_quest(ctx, id)
-            return
-        elif entity_type == "journal":
-            await self.display_journal(ctx, id)
-            return
-        elif entity_type == "item":
-            await self.display_item(ctx, id)
-            return
-        elif entity_type == "event":
-            await self.display_event(ctx, id)
-            return
-        elif entity_type == "note":
-            await self.display_note(ctx, id)
-            return
-        elif entity_type == "tag":
-            await self.display_tag(ctx, id)
-            return
-        elif entity_type == "ability":
-            await self.display_ability(ctx, id)
-            return
-        elif entity_type == "creature":
-            await self.display_creature(ctx, id)
-        else:
+        cls = ENTITY_REGISTRY.get(entity_type)
+        if cls is None:
             await ctx.send(MSG_ENTITY_NOT_FOUND)
             return
+        await getattr(self, cls.display)(ctx, id)
 
     @kanka.command(name="refresh")
-    async def load_cache(self, ctx):
-        """Cache basic entity information. May help reduce loading times."""
-        await ctx.send("Loading Entity info...")
-        await self._cache_entities(await self._active(ctx))
-        length = 0
-        for value in CACHE.values():
-            length += len(value)
-        await ctx.send(str(length) + " Entities loaded.")
+    async def load_cache(self, ctx, full: bool = False):
+        """Cache basic entity information. May help reduce loading times.
+
+        Only entities changed since the last refresh are loaded, unless
+        full is true."""
+        campaign_id = await self._active(ctx)
+        if full or self.cache.last_sync(campaign_id) is None:
+            self.full_cache.clear(campaign_id)
+            self.embed_cache.clear(campaign_id)
+            await self._load_cache_with_progress(ctx, campaign_id)
+        else:
+            updated = await self._sync_entities(campaign_id)
+            await ctx.send(f"{updated} Entities updated.")
 
     @commands.group(name="kankaset")
     @checks.admin_or_permissions(manage_guild=True)
@@ -1251,9 +2507,96 @@ class KankaView(commands.Cog):
         if token[:7] != "Bearer ":
             token = "Bearer " + token
         await self.config.token.set(token)
-        await self._set_headers()
+        # Rebuilding the session drops pooled connections, so only do it
+        # when the token has actually changed
+        if token != self._token or self.session is None:
+            await self._set_headers()
+            # A different token may be allowed to see different entities
+            self.embed_cache.clear()
         await ctx.send("API token set.")
 
+    @kankaset.command(name="ratelimit")
+    @checks.is_owner()
+    async def set_rate_limit(self, ctx, requests_per_minute: int):
+        """Set how many requests a minute the bot may make to Kanka.
+        The limit is 30 for most accounts, or 90 for subscribers."""
+        if requests_per_minute < 1:
+            await ctx.send_help()
+            return
+        await self.config.rate_limit.set(requests_per_minute)
+        self.limiter.rate = requests_per_minute
+        await ctx.send(f"Rate limit set to {requests_per_minute} requests a minute.")
+
+    @kankaset.command(name="syncinterval")
+    @checks.is_owner()
+    async def set_sync_interval(self, ctx, minutes: int):
+        """Set how often loaded campaigns are checked for changes.
+        Set to 0 to disable background syncing."""
+        if minutes < 0:
+            await ctx.send_help()
+            return
+        await self.config.sync_interval.set(minutes)
+        if minutes:
+            await ctx.send(f"Campaigns will be synced every {minutes} minutes.")
+        else:
+            await ctx.send("Background syncing disabled.")
+
+    @kankaset.group(name="cache")
+    @checks.is_owner()
+    async def cache_settings(self, ctx):
+        """Entity cache limits and statistics."""
+
+    @cache_settings.command(name="stats")
+    async def cache_stats(self, ctx):
+        """Show how well the entity cache is working."""
+        stats = self.cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = stats["hits"] / lookups if lookups else 0
+        await ctx.send(
+            f"{stats['entities']}/{self.cache.max_entries} entities cached, using "
+            f"about {stats['size'] / 2**20:.1f}/{self.cache.max_bytes / 2**20:.1f} MiB."
+            f"\n{stats['hits']} hits, {stats['misses']} misses ({hit_rate:.0%} hit "
+            f"rate), {stats['evictions']} evictions, {stats['expirations']} expired."
+            f"\nFull entities: {self.full_cache.hits} served from memory, "
+            f"{self.full_cache.revalidated} revalidated unchanged, "
+            f"{self.embed_cache.hits} embeds reused."
+        )
+
+    @cache_settings.command(name="entries")
+    async def set_cache_entries(self, ctx, max_entries: int):
+        """Set the most entities that will be cached across all campaigns."""
+        if max_entries < 1:
+            await ctx.send_help()
+            return
+        await self.config.cache_max_entries.set(max_entries)
+        self.cache.max_entries = max_entries
+        await ctx.send(f"Up to {max_entries} entities will be cached.")
+
+    @cache_settings.command(name="memory")
+    async def set_cache_memory(self, ctx, megabytes: int):
+        """Set roughly how much memory in MiB the entity cache may use."""
+        if megabytes < 1:
+            await ctx.send_help()
+            return
+        await self.config.cache_max_bytes.set(megabytes * 2**20)
+        self.cache.max_bytes = megabytes * 2**20
+        await ctx.send(f"The entity cache will use up to about {megabytes} MiB.")
+
+    @cache_settings.command(name="ttl")
+    async def set_cache_ttl(self, ctx, entity_type: str, minutes: int):
+        """Set how long cached entities of a type are kept, such as
+        `characters 60`. Use 0 minutes to return to the default of a day."""
+        if entity_type not in ENTITY_TYPES.values() or minutes < 0:
+            await ctx.send_help()
+            return
+        async with self.config.cache_ttls() as ttls:
+            if minutes:
+                ttls[entity_type] = minutes * 60
+            else:
+                ttls.pop(entity_type, None)
+            self.cache.ttls = dict(ttls)
+        await ctx.send(f"TTL for cached {entity_type} set.")
+
     @kankaset.command(name="language")
     async def set_language(self, ctx, language: str):
         """Set language used in links. Valid language codes are en, de, en-US,
@@ -1261,6 +2604,8 @@ class KankaView(commands.Cog):
         LANGUAGES = ["en", "de", "en-US", "es", "fr", "pt-BR"]
         if language in LANGUAGES:
             await self.config.guild(ctx.guild).language.set(language)
+            self._forget_settings(ctx.guild)
+            self.embed_cache.clear()
             await ctx.send(f"Language set to {language}")
         else:
             await ctx.send_help()
@@ -1268,12 +2613,13 @@ class KankaView(commands.Cog):
     @kankaset.command(name="toggleprivate")
     async def hide_private(self, ctx):
         """Toggle if private entities are hidden."""
-        hide_private = await self.config.guild(ctx.guild).hide_private()
+        hide_private = (await self._settings(ctx.guild)).hide_private
+        await self.config.guild(ctx.guild).hide_private.set(not hide_private)
+        self._forget_settings(ctx.guild)
+        self.embed_cache.clear()
         if hide_private:
-            await self.config.guild(ctx.guild).hide_private.set(False)
             await ctx.send("Now showing private entities.")
         else:
-            await self.config.guild(ctx.guild).hide_private.set(True)
             await ctx.send("Now hiding private entities.")
 
     @kankaset.command(name="reset")
@@ -1281,7 +2627,9 @@ class KankaView(commands.Cog):
         """Return to default settings."""
         # TODO: Add confirmation before deletion for safety
         await self.config.guild(ctx.guild).clear()
-        CACHE.clear()
+        self._forget_settings(ctx.guild)
+        self.cache.release(ctx.guild.id)
+        self.embed_cache.clear()
         await ctx.send("Server specific settings reset to default.")
 
     @kankaset.command(name="forceheaders")
@@ -2,5 +2,5 @@ from .quake import Quake
 
 
 async def setup(bot):
-    n = Quake()
+    n = Quake(bot)
     await bot.add_cog(n)
@@ -1,13 +1,587 @@
+import asyncio
+import logging
+import math
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import date, datetime
+
 import aiohttp
 import discord
-from dateutil import parser as dtparse
-from redbot.core import commands
+from redbot.core import Config, checks, commands
+from redbot.core.data_manager import cog_data_path
+
+try:
+    # Much faster than json, and Red usually has it installed
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 # This cog is only possible because of GeoNet (https://www.geonet.org.nz).
 
+GEONET_URL = "https://api.geonet.org.nz/quake"
+GEONET_HEADERS = {
+    "accept": "application/vnd.geo+json;version=2",
+    "Accept-Encoding": "gzip",
+}
+FEED_TTL = 30  # Seconds a downloaded feed is reused for
+LOWEST_MMI = -1  # The feed with every quake, used to answer any threshold
+POLL_INTERVAL = 60  # Seconds between checks for new quakes to announce
+MIN_POLL_INTERVAL = 30
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# History columns and their array type codes, one file each
+HISTORY_COLUMNS = {
+    "time": "q",  # Milliseconds since the epoch
+    "magnitude": "d",
+    "depth": "d",  # km
+    "mmi": "b",
+    "longitude": "d",
+    "latitude": "d",
+}
+MAGNITUDE_BIN = 0.1  # GeoNet's magnitude resolution
+B_VALUE_MIN_QUAKES = 30  # Quakes above completeness needed for a b-value
+
+EARTH_RADIUS = 6371.0  # km
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+GRID_DEGREES = 0.5  # Size of the spatial index's cells
+NEAR_RADIUS = 50  # km
+NEAR_RESULTS = 10
+
+
+class QuakeRecord:
+    """A quake from a GeoNet feed, holding only what the cog uses."""
+
+    __slots__ = (
+        "public_id",
+        "time",  # Milliseconds since the epoch
+        "magnitude",
+        "depth",  # km
+        "mmi",
+        "longitude",
+        "latitude",
+        "locality",
+        "quality",
+    )
+
+    def __init__(self, feature):
+        properties = feature["properties"]
+        self.public_id = properties["publicID"]
+        self.time = _parse_time(properties["time"])
+        self.magnitude = properties["magnitude"] or 0.0
+        self.depth = properties["depth"] or 0.0
+        mmi = properties["mmi"]
+        self.mmi = int(mmi) if mmi is not None else -1
+        self.longitude, self.latitude = feature["geometry"]["coordinates"][:2]
+        self.locality = properties["locality"]
+        self.quality = properties["quality"]
+
+    @property
+    def coords(self):
+        return [self.longitude, self.latitude]
+
+
+def _parse_time(text):
+    """Milliseconds since the epoch from one of GeoNet's UTC timestamps,
+    like 2024-01-31T04:05:06.789Z.
+
+    They always use this format, so the fields are sliced out directly
+    rather than using a general ISO 8601 parser."""
+    if len(text) >= 20 and text[10] == "T" and text[-1] == "Z":
+        days = (
+            date(int(text[0:4]), int(text[5:7]), int(text[8:10])).toordinal()
+            - EPOCH_ORDINAL
+        )
+        seconds = (
+            days * 86400
+            + int(text[11:13]) * 3600
+            + int(text[14:16]) * 60
+            + int(text[17:19])
+        )
+        millis = int(text[20:-1].ljust(3, "0")[:3]) if text[19] == "." else 0
+        return seconds * 1000 + millis
+    # Anything else, such as an explicit offset
+    return round(datetime.fromisoformat(text).timestamp() * 1000)
+
+
+def _decode_feed(body):
+    """Quakes from a GeoNet GeoJSON response, in the feed's order, and the
+    public IDs of deleted quakes, which are left out."""
+    quakes = []
+    deleted = set()
+    for feature in json_loads(body)["features"]:
+        try:
+            # Possibly quality levels are best, preliminary, automatic, deleted
+            if feature["properties"]["quality"] == "deleted":
+                deleted.add(feature["properties"]["publicID"])
+            else:
+                quakes.append(QuakeRecord(feature))
+        except (KeyError, ValueError, TypeError):
+            # Skip a malformed quake rather than the whole feed
+            continue
+    return quakes, deleted
+
+
+class QuakeHistory:
+    """Every quake the cog has seen, kept in time order as one typed array
+    per column so statistics never go back over the JSON.
+
+    Each column is saved to its own file of raw values, alongside a file
+    of public IDs. New quakes are appended to the files and revisions are
+    written over their rows. The files are only rewritten from the first
+    row that moved when a quake is deleted, arrives late or has its time
+    revised.
+
+    Location searches use a grid of GRID_DEGREES cells holding the rows
+    of the quakes in them, built when first needed and kept up to date
+    until rows move."""
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = {name: array(code) for name, code in HISTORY_COLUMNS.items()}
+        self.ids = []
+        self._rows = {}  # publicID -> row
+        self._saved = 0  # Rows already on disk
+        self._ids_size = 0  # Bytes of saved IDs, None if not yet counted
+        self._dirty = set()  # Saved rows revised since
+        self._rewrite = False
+        self._grid = None  # (latitude cell, longitude cell) -> rows
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self):
+        ids_path = self.path / "ids.txt"
+        if not ids_path.exists():
+            # Columns without IDs are left from a save that was cut short
+            self._rewrite = any(self.path.glob("*.bin"))
+            return
+        data = ids_path.read_bytes()
+        ids = data.decode().split("\n")
+        # Drop the empty string after the last newline, or a partly
+        # written ID
+        ids.pop()
+        sizes = [len(data)]
+        for name, column in self.columns.items():
+            column_path = self.path / f"{name}.bin"
+            data = column_path.read_bytes() if column_path.exists() else b""
+            column.frombytes(data[: len(data) - len(data) % column.itemsize])
+            sizes.append(len(data))
+        # A save may have been cut short, keep only the complete rows
+        rows = min(len(ids), *(len(c) for c in self.columns.values()))
+        self.ids = ids[:rows]
+        for column in self.columns.values():
+            del column[rows:]
+        self._rows = {public_id: i for i, public_id in enumerate(self.ids)}
+        self._saved = rows
+        self._ids_size = sum(len(public_id) + 1 for public_id in self.ids)
+        # Any file holding more than the complete rows must be rewritten,
+        # or later rows would be appended after the leftovers
+        expected = [self._ids_size] + [
+            rows * column.itemsize for column in self.columns.values()
+        ]
+        self._rewrite = sizes != expected
+
+    def save(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        start = 0 if self._rewrite else self._saved
+        dirty = sorted(row for row in self._dirty if row < start)
+        for name, column in self.columns.items():
+            with self._open(self.path / f"{name}.bin") as f:
+                for row in dirty:
+                    f.seek(row * column.itemsize)
+                    f.write(column[row : row + 1].tobytes())
+                f.seek(start * column.itemsize)
+                column[start:].tofile(f)
+                f.truncate()
+        if self._rewrite or self._ids_size is None:
+            self._ids_size = sum(len(public_id) + 1 for public_id in self.ids[:start])
+        data = "".join(f"{public_id}\n" for public_id in self.ids[start:]).encode()
+        with self._open(self.path / "ids.txt") as f:
+            f.seek(self._ids_size)
+            f.write(data)
+            f.truncate()
+        self._saved = len(self.ids)
+        self._ids_size += len(data)
+        self._dirty.clear()
+        self._rewrite = False
+
+    def _open(self, path):
+        # Written in place unless being rewritten
+        if self._rewrite or not path.exists():
+            return open(path, "wb")
+        return open(path, "r+b")
+
+    def add(self, quake):
+        """Record a QuakeRecord, replacing any earlier version. Returns True
+        if the history changed.
+
+        Raises TypeError or OverflowError, leaving the history unchanged,
+        if a value doesn't fit its column."""
+        # Convert every value before touching the columns, so a bad one
+        # can't leave them different lengths
+        values = {
+            name: array(code, [getattr(quake, name)])[0]
+            for name, code in HISTORY_COLUMNS.items()
+        }
+        public_id = quake.public_id
+        row = self._rows.get(public_id)
+        if row is not None:
+            if all(self.columns[name][row] == values[name] for name in values):
+                return False
+            if self.columns["time"][row] == values["time"]:
+                # Most revisions only change the magnitude, depth or MMI,
+                # so the quake keeps its row
+                if self._grid is not None:
+                    old = self._cell(
+                        self.columns["latitude"][row], self.columns["longitude"][row]
+                    )
+                    new = self._cell(values["latitude"], values["longitude"])
+                    if old != new:
+                        self._grid[old].remove(row)
+                        self._grid.setdefault(new, []).append(row)
+                for name, column in self.columns.items():
+                    column[row] = values[name]
+                if row < self._saved:
+                    self._dirty.add(row)
+                return True
+            self._delete(row)
+
+        row = bisect_right(self.columns["time"], values["time"])
+        if row == len(self.ids):
+            for name, column in self.columns.items():
+                column.append(values[name])
+            self.ids.append(public_id)
+            self._rows[public_id] = row
+            if self._grid is not None:
+                cell = self._cell(values["latitude"], values["longitude"])
+                self._grid.setdefault(cell, []).append(row)
+        else:
+            # Arrived out of order
+            for name, column in self.columns.items():
+                column.insert(row, values[name])
+            self.ids.insert(row, public_id)
+            self._reindex(row)
+        return True
+
+    def remove(self, public_id):
+        """Forget a quake that has been deleted. Returns True if it was
+        recorded."""
+        row = self._rows.get(public_id)
+        if row is None:
+            return False
+        self._delete(row)
+        return True
+
+    def _delete(self, row):
+        for column in self.columns.values():
+            del column[row]
+        del self._rows[self.ids.pop(row)]
+        self._reindex(row)
+
+    def _reindex(self, start):
+        """Update after the rows from start onwards have moved."""
+        for row in range(start, len(self.ids)):
+            self._rows[self.ids[row]] = row
+        # They are written out again on the next save
+        if start < self._saved:
+            self._saved = start
+            self._ids_size = None
+        self._grid = None
+
+    def window(self, start, end):
+        """The range of rows with times from start to end in milliseconds."""
+        times = self.columns["time"]
+        return bisect_left(times, start), bisect_left(times, end)
+
+    @staticmethod
+    def _cell(latitude, longitude):
+        return (
+            math.floor(latitude / GRID_DEGREES),
+            math.floor(longitude % 360 / GRID_DEGREES),
+        )
+
+    def near(self, latitude, longitude, radius):
+        """Rows of the quakes within radius km of a point, with their
+        distances, newest first."""
+        if self._grid is None:
+            self._grid = {}
+            lats = self.columns["latitude"]
+            lons = self.columns["longitude"]
+            for row in range(len(self.ids)):
+                cell = self._cell(lats[row], lons[row])
+                self._grid.setdefault(cell, []).append(row)
+
+        # Every cell the circle could reach
+        lat_span = radius / KM_PER_DEGREE
+        lat_first, _ = self._cell(max(latitude - lat_span, -90), 0)
+        lat_last, _ = self._cell(min(latitude + lat_span, 90), 0)
+        widest = math.cos(math.radians(min(abs(latitude) + lat_span, 89.9)))
+        lon_span = min(radius / (KM_PER_DEGREE * widest), 180)
+        columns = round(360 / GRID_DEGREES)
+        lon_first = math.floor((longitude - lon_span) / GRID_DEGREES)
+        lon_last = math.floor((longitude + lon_span) / GRID_DEGREES)
+        lon_cells = {c % columns for c in range(lon_first, lon_last + 1)}
+
+        lats = self.columns["latitude"]
+        lons = self.columns["longitude"]
+        phi = math.radians(latitude)
+        cos_phi = math.cos(phi)
+        found = []
+        for lat_cell in range(lat_first, lat_last + 1):
+            for lon_cell in lon_cells:
+                for row in self._grid.get((lat_cell, lon_cell), ()):
+                    # Haversine distance
+                    phi2 = math.radians(lats[row])
+                    a = (
+                        math.sin((phi2 - phi) / 2) ** 2
+                        + cos_phi
+                        * math.cos(phi2)
+                        * math.sin(math.radians(lons[row] - longitude) / 2) ** 2
+                    )
+                    distance = 2 * EARTH_RADIUS * math.asin(min(1, math.sqrt(a)))
+                    if distance <= radius:
+                        found.append((row, distance))
+        found.sort(reverse=True)
+        return found
+
+
+def _map_url(coords):
+    # GeoJSON uses [long, lat] but Google uses [lat, long] so we reverse it
+    coords_str = "%2C".join(str(e) for e in reversed(coords))  # %2C is a comma
+    return f"https://www.google.com/maps/search/?api=1&query={coords_str}"
+
+
+def _b_value(magnitudes):
+    """Gutenberg-Richter b-value by Aki's maximum likelihood method.
+
+    The magnitude of completeness is estimated by maximum curvature, the
+    most common magnitude. Returns the b-value, or None if too few quakes
+    are above completeness, with the completeness magnitude."""
+    counts = Counter(round(m / MAGNITUDE_BIN) for m in magnitudes)
+    completeness = max(counts, key=counts.get) * MAGNITUDE_BIN
+    # Magnitudes are binned, so the bin starts half a bin lower (Utsu)
+    lowest = completeness - MAGNITUDE_BIN / 2
+    complete = [m for m in magnitudes if m >= lowest]
+    if len(complete) < B_VALUE_MIN_QUAKES:
+        return None, completeness
+    mean = math.fsum(complete) / len(complete)
+    return math.log10(math.e) / (mean - lowest), completeness
+
 
 class Quake(commands.Cog):
-    @commands.command()
+    def __init__(self, bot):
+        self.bot = bot
+        self.config = Config.get_conf(
+            self, identifier=74392017538164920, force_registration=True
+        )
+        self.config.register_global(poll_interval=POLL_INTERVAL)
+        self.config.register_channel(min_mmi=None)
+        self.session = None
+        self._feeds = {}  # MMI -> (expiry, (quakes, deleted IDs))
+        self._validators = {}  # MMI -> headers making the next fetch conditional
+        self._fetching = {}  # MMI -> task downloading that feed
+        self._seen = None  # publicID -> quality of every quake already announced
+        self.history = QuakeHistory(cog_data_path(self) / "history")
+        self._poll_task = None
+        self.log = logging.getLogger("red.Athena-Cogs.quake")
+
+    async def cog_load(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.history.load)
+        except OSError as e:
+            self.log.warning(f"Unable to load quake history: {e}")
+        self._poll_task = asyncio.create_task(self._poll_loop())
+
+    async def cog_unload(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+        if self.session is not None:
+            await self.session.close()
+
+    async def _feed(self, mmi):
+        """Quakes with at least the given MMI as QuakeRecords, newest first,
+        and the IDs of deleted quakes, or None if GeoNet couldn't be reached.
+
+        Feeds are kept for FEED_TTL seconds, and callers asking for the
+        same feed at once share one download."""
+        cached = self._feeds.get(mmi)
+        if cached is not None and time.monotonic() < cached[0]:
+            return cached[1]
+        task = self._fetching.get(mmi)
+        if task is None:
+            task = asyncio.ensure_future(self._download(mmi))
+            self._fetching[mmi] = task
+            task.add_done_callback(lambda t: self._fetching.pop(mmi, None))
+        return await asyncio.shield(task)
+
+    async def _download(self, mmi):
+        # Call the GeoNet API https://api.geonet.org.nz
+        # Returns quakes with the given MMI or more in the New Zealand region
+        # during the last 365 days up to a maximum of 100 quakes.
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(headers=GEONET_HEADERS)
+        cached = self._feeds.get(mmi)
+        headers = self._validators.get(mmi) if cached is not None else None
+        try:
+            async with self.session.get(
+                GEONET_URL, params={"MMI": mmi}, headers=headers
+            ) as r:
+                if r.status == 304:
+                    # Nothing new since last time
+                    feed = cached[1]
+                elif r.status == 200:
+                    # Decoded once here, everything else uses the records
+                    feed = _decode_feed(await r.read())
+                    self._validators[mmi] = {}
+                    if "ETag" in r.headers:
+                        self._validators[mmi]["If-None-Match"] = r.headers["ETag"]
+                    if "Last-Modified" in r.headers:
+                        self._validators[mmi]["If-Modified-Since"] = r.headers[
+                            "Last-Modified"
+                        ]
+                else:
+                    return None
+        except (
+            aiohttp.ClientError,
+            asyncio.TimeoutError,
+            ValueError,
+            KeyError,
+            TypeError,
+        ):
+            return None
+        self._feeds[mmi] = (time.monotonic() + FEED_TTL, feed)
+        return feed
+
+    async def _latest(self, mmi):
+        """The most recent quake with at least the given MMI that hasn't
+        been deleted, False if there isn't one, or None if GeoNet couldn't
+        be reached.
+
+        The lowest threshold feed holds every recent quake so any MMI can be
+        picked out of it. It is capped at 100 quakes though, so when none
+        of those are strong enough the feed for the threshold is used."""
+        feeds = [LOWEST_MMI] if mmi <= LOWEST_MMI else [LOWEST_MMI, mmi]
+        for threshold in feeds:
+            feed = await self._feed(threshold)
+            if feed is None:
+                return None
+            for quake in feed[0]:
+                if quake.mmi >= mmi:
+                    return quake
+        return False
+
+    async def _poll_loop(self):
+        await self.bot.wait_until_red_ready()
+        while True:
+            try:
+                await self._poll()
+            except Exception:
+                self.log.exception("Error while checking for new quakes.")
+            await asyncio.sleep(await self.config.poll_interval())
+
+    async def _poll(self):
+        """Record quakes in the history, and announce quakes that are new,
+        or have a new quality, since the last poll to every channel
+        subscribed at their MMI.
+
+        One download of the feed serves every subscription. Quakes already
+        in the feed at the first poll are not announced."""
+        feed = await self._feed(LOWEST_MMI)
+        if feed is None:
+            return
+        quakes, deleted = feed
+        seen = {quake.public_id: quake.quality for quake in quakes}
+        await self._record(quakes, deleted)
+
+        subscriptions = {
+            channel_id: data["min_mmi"]
+            for channel_id, data in (await self.config.all_channels()).items()
+            if data.get("min_mmi") is not None
+        }
+        if not subscriptions:
+            # Start afresh when someone subscribes
+            self._seen = None
+            return
+        if self._seen is None:
+            self._seen = seen
+            return
+
+        # Oldest first so channels get them in order
+        for quake in reversed(quakes):
+            previous = self._seen.get(quake.public_id)
+            if quake.quality == previous:
+                continue
+            if previous is None:
+                description = "New quake on GeoNet"
+            else:
+                description = (
+                    f"Quake quality changed from {previous} to {quake.quality}"
+                )
+            em = None
+            for channel_id, min_mmi in subscriptions.items():
+                if quake.mmi < min_mmi:
+                    continue
+                channel = self.bot.get_channel(channel_id)
+                if channel is None:
+                    continue
+                if em is None:
+                    em = self._embed(quake, description)
+                try:
+                    await channel.send(embed=em)
+                except discord.HTTPException as e:
+                    self.log.warning(f"Unable to announce quake in {channel_id}: {e}")
+        self._seen = seen
+
+    async def _record(self, quakes, deleted):
+        """Add new and revised quakes to the history, drop deleted ones and
+        save it."""
+        changed = False
+        for quake in reversed(quakes):
+            try:
+                if self.history.add(quake):
+                    changed = True
+            except (TypeError, OverflowError) as e:
+                self.log.warning(f"Unable to record quake {quake.public_id}: {e}")
+        for public_id in deleted:
+            if self.history.remove(public_id):
+                changed = True
+        if changed:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self.history.save)
+            except OSError as e:
+                self.log.warning(f"Unable to save quake history: {e}")
+
+    def _embed(self, quake, description):
+        # Get a timestamp for use with Discord time formatting
+        timestamp = quake.time // 1000
+
+        # Generate url with map marker
+        map_url = _map_url(quake.coords)
+
+        # Create the embed
+        em = discord.Embed(
+            title=quake.public_id,
+            description=description,
+            url="https://www.geonet.org.nz/quakes/"
+            "region/newzealand/{}".format(quake.public_id),
+            colour=discord.Color.orange(),
+        )
+        em.add_field(name="Magnitude", value=quake.magnitude)
+        em.add_field(name="Time", value=f"<t:{timestamp}:R>")
+        em.add_field(name="Quality", value=quake.quality)
+        em.add_field(
+            name="Location",
+            value="[{}]({})".format(quake.locality, map_url),
+        )
+        em.add_field(name="MMI", value=quake.mmi)
+        em.add_field(name="Depth", value=str(quake.depth) + " km")
+        return em
+
+    @commands.group(invoke_without_command=True)
     async def quake(self, ctx, mmi: int = 3):
         """Polls GeoNet for their latest quake and publishes the info"""
         if mmi < -1 or mmi > 8:
@@ -16,68 +590,141 @@ class Quake(commands.Cog):
                 "between -1 and 8 inclusive. Defaults to 3 when"
                 "left blank."
             )
+            return
+
+        quake = await self._latest(mmi)
+        if quake is None:
+            await ctx.send("Unable to reach GeoNet, try again in a moment.")
+            return
+        elif not quake:
+            await ctx.send(
+                "No quakes found that match the given parameters in the last 365 days."
+            )
+            return
+
+        em = self._embed(quake, "Most recent quake with MMI>={} on GeoNet".format(mmi))
+        await ctx.send(embed=em)
+
+    @quake.command(name="stats")
+    async def quake_stats(self, ctx, days: float = 30):
+        """Summarise the quakes recorded over the last given number of days.
+
+        Quakes are recorded while the cog is loaded, so the history only
+        goes back to when it was installed."""
+        if days <= 0:
+            await ctx.send_help()
+            return
+        end = round(time.time() * 1000)
+        start = end - round(days * 24 * 60 * 60 * 1000)
+        first, last = self.history.window(start, end)
+        columns = self.history.columns
+        magnitudes = columns["magnitude"][first:last]
+        if not magnitudes:
+            await ctx.send(f"No quakes recorded in the last {days:g} days.")
+            return
+
+        em = discord.Embed(
+            title=f"Quakes in the last {days:g} days",
+            description=f"{len(magnitudes)} quakes recorded, "
+            f"{sum(1 for mmi in columns['mmi'][first:last] if mmi >= 3)} "
+            "with MMI>=3.",
+            colour=discord.Color.orange(),
+        )
+
+        largest = first + max(range(len(magnitudes)), key=magnitudes.__getitem__)
+        coords = [columns["longitude"][largest], columns["latitude"][largest]]
+        em.add_field(
+            name="Largest",
+            value=f"[{self.history.ids[largest]}](https://www.geonet.org.nz/quakes/"
+            f"region/newzealand/{self.history.ids[largest]}), "
+            f"M{columns['magnitude'][largest]:.1f} at "
+            f"{columns['depth'][largest]:.0f} km depth, "
+            f"<t:{columns['time'][largest] // 1000}:R> ([map]({_map_url(coords)}))",
+            inline=False,
+        )
+
+        # One bar per whole magnitude
+        bins = Counter(math.floor(m) for m in magnitudes)
+        most = max(bins.values())
+        lines = [
+            f"M{m:<2} {bins[m]:>6} {'#' * math.ceil(bins[m] / most * 20)}"
+            for m in range(min(bins), max(bins) + 1)
+        ]
+        em.add_field(
+            name="Magnitudes", value="```\n" + "\n".join(lines) + "\n```", inline=False
+        )
+
+        b_value, completeness = _b_value(magnitudes)
+        if b_value is None:
+            value = "Not enough quakes to estimate."
         else:
-            # Call the GeoNet API https://api.geonet.org.nz
-            # Returns quakes with MMI >= 3 in the New Zealand region during the
-            # last 365 days up to a maximum of 100 quakes.
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    "https://api.geonet.org.nz/quake",
-                    params={"MMI": mmi},
-                    headers={
-                        "accept": "application/vnd.geo+json;version=2",
-                        "Accept-Encoding": "gzip",
-                    },
-                ) as recentquakes:
-                    # Convert to json
-                    jsonified = await recentquakes.json()
-
-                    # Grabs the most recent quake that hasn't been deleted
-                    # Possibly quality levels are best, preliminary, automatic, deleted
-                    shake = {"quality": "deleted"}
-                    i = 0
-                    max_i = len(jsonified["features"])
-                    while shake["quality"] == "deleted":
-                        if i >= max_i:
-                            await ctx.send(
-                                "No quakes found that match the given parameters in the last 365 days."
-                            )
-                            return
-                        shake = jsonified["features"][i]["properties"]
-                        shake["coords"] = jsonified["features"][i]["geometry"][
-                            "coordinates"
-                        ]
-                        i += 1
-
-                    # Get a timestamp for use with Discord time formatting
-                    timestamp = round(dtparse.parse(shake["time"]).timestamp())
-
-                    # Generate url with map marker
-                    # GeoJSOMN uses [long, lat] but Google uses [lat, long] so we reverse it
-                    coords_str = "%2C".join(
-                        str(e) for e in reversed(shake["coords"])
-                    )  # %2C is a comma
-                    map_url = (
-                        f"https://www.google.com/maps/search/?api=1&query={coords_str}"
-                    )
+            value = f"{b_value:.2f}, from quakes above M{completeness:.1f}"
+        em.add_field(name="Gutenberg-Richter b-value", value=value, inline=False)
+        await ctx.send(embed=em)
 
-                    # Create the embed
-                    em = discord.Embed(
-                        title=shake["publicID"],
-                        description="Most recent quake with MMI>={} "
-                        "on GeoNet".format(mmi),
-                        url="https://www.geonet.org.nz/quakes/"
-                        "region/newzealand/{}".format(shake["publicID"]),
-                        colour=discord.Color.orange(),
-                    )
-                    em.add_field(name="Magnitude", value=shake["magnitude"])
-                    em.add_field(name="Time", value=f"<t:{timestamp}:R>")
-                    em.add_field(name="Quality", value=shake["quality"])
-                    em.add_field(
-                        name="Location",
-                        value="[{}]({})".format(shake["locality"], map_url),
-                    )
-                    em.add_field(name="MMI", value=shake["mmi"])
-                    em.add_field(name="Depth", value=str(shake["depth"]) + " km")
+    @quake.command(name="near")
+    async def quake_near(
+        self, ctx, latitude: float, longitude: float, radius_km: float = NEAR_RADIUS
+    ):
+        """List the most recent recorded quakes within radius_km of a place,
+        given as decimal degrees like `-41.29 174.78`."""
+        if abs(latitude) > 90 or abs(longitude) > 180 or radius_km <= 0:
+            await ctx.send_help()
+            return
+        found = self.history.near(latitude, longitude, radius_km)
+        if not found:
+            await ctx.send(f"No quakes recorded within {radius_km:g} km.")
+            return
+
+        columns = self.history.columns
+        lines = []
+        for row, distance in found[:NEAR_RESULTS]:
+            public_id = self.history.ids[row]
+            lines.append(
+                f"[M{columns['magnitude'][row]:.1f}](https://www.geonet.org.nz/"
+                f"quakes/region/newzealand/{public_id}) {distance:.0f} km away, "
+                f"{columns['depth'][row]:.0f} km deep, MMI {columns['mmi'][row]}, "
+                f"<t:{columns['time'][row] // 1000}:R>"
+            )
+        em = discord.Embed(
+            title=f"Quakes within {radius_km:g} km of {latitude:g}, {longitude:g}",
+            description=f"{len(found)} quakes recorded, the latest are:\n"
+            + "\n".join(lines),
+            url=_map_url([longitude, latitude]),
+            colour=discord.Color.orange(),
+        )
+        await ctx.send(embed=em)
 
-                    await ctx.send(embed=em)
+    @commands.group(name="quakeset")
+    @checks.admin_or_permissions(manage_guild=True)
+    async def quakeset(self, ctx):
+        """Configuration commands for Quake"""
+
+    @quakeset.command(name="subscribe")
+    async def subscribe(self, ctx, channel: discord.TextChannel, min_mmi: int = 3):
+        """Announce new quakes with at least the given MMI in a channel."""
+        if min_mmi < -1 or min_mmi > 8:
+            await ctx.send_help()
+            return
+        await self.config.channel(channel).min_mmi.set(min_mmi)
+        await ctx.send(
+            f"Quakes with MMI>={min_mmi} will be posted in {channel.mention}."
+        )
+
+    @quakeset.command(name="unsubscribe")
+    async def unsubscribe(self, ctx, channel: discord.TextChannel):
+        """Stop announcing quakes in a channel."""
+        await self.config.channel(channel).clear()
+        await ctx.send(f"Quakes will no longer be posted in {channel.mention}.")
+
+    @quakeset.command(name="interval")
+    @checks.is_owner()
+    async def set_poll_interval(self, ctx, seconds: int):
+        """Set how often GeoNet is checked for new quakes to announce."""
+        if seconds < MIN_POLL_INTERVAL:
+            await ctx.send(
+                f"The interval must be at least {MIN_POLL_INTERVAL} seconds."
+            )
+            return
+        await self.config.poll_interval.set(seconds)
+        await ctx.send(f"GeoNet will be checked every {seconds} seconds.")